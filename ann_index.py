@@ -0,0 +1,369 @@
+# ann_index.py
+import json
+import math
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# Формат спецификации: "Flat", "HNSW:M=32,efConstruction=200,efSearch=64",
+# "IVFFlat:nlist=256,nprobe=16", "IVFPQ:nlist=256,m=16,nbits=8,nprobe=16,rerank=1",
+# компактные: "SQ8:rerank=4", "SQfp16:rerank=2", "PQ:m=48,nbits=8,rerank=8"
+DEFAULT_INDEX_SPEC = "Flat"
+INDEX_KINDS = ("Flat", "HNSW", "IVFFlat", "IVFPQ", "SQ8", "SQfp16", "PQ")
+COMPACT_KINDS = ("SQ8", "SQfp16", "PQ")
+# Индексы с кодами вместо векторов: рядом хранятся float-векторы (RerankedIndex) —
+# расстояния и косинусные оценки считаются по ним, а не по декодированным кодам
+LOSSY_KINDS = COMPACT_KINDS + ("IVFPQ",)
+DEFAULT_PARAMS = {
+    "Flat": {},
+    "HNSW": {"M": 32, "efConstruction": 200, "efSearch": 64},
+    "IVFFlat": {"nlist": 256, "nprobe": 16},
+    "IVFPQ": {"nlist": 256, "m": 16, "nbits": 8, "nprobe": 16, "rerank": 1},
+    "SQ8": {"rerank": 4},
+    "SQfp16": {"rerank": 2},
+    "PQ": {"m": 48, "nbits": 8, "rerank": 8},
+}
+REPORT_TOP_K = 10
+REPORT_QUERIES = 200
+COMPACT_MIN_OVERLAP = 0.95  # минимальное совпадение top-k компактного индекса с float-индексом
+# Фильтр не больше стольких id считаем точно: HNSW/IVF видят только кандидатов efSearch/nprobe,
+# и разрешённые id вне них теряются (результат добивается -1)
+EXACT_FILTER_MAX = 4096
+
+
+# Компактный индекс: квантованные коды в памяти + точный пересчёт короткого списка
+# по float-векторам (на диске они отображаются через mmap и читаются только нужные строки)
+class RerankedIndex:
+    def __init__(self, index, vectors: np.ndarray, rerank: int):
+        self.index = index
+        self.vectors = vectors
+        self.rerank = max(1, int(rerank))
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    def _exact(self, queries: np.ndarray, ids: np.ndarray, k: int):
+        D = np.full((len(queries), k), np.inf, dtype="float32")
+        I = np.full((len(queries), k), -1, dtype="int64")
+        for row, (q, row_ids) in enumerate(zip(queries, ids)):
+            row_ids = row_ids[row_ids >= 0]
+            if not len(row_ids):
+                continue
+            order = np.argsort(row_ids)  # последовательное чтение mmap
+            row_ids = row_ids[order]
+            dist = ((np.asarray(self.vectors[row_ids], dtype="float32") - q) ** 2).sum(axis=1)
+            best = np.argsort(dist, kind="stable")[:k]
+            D[row, :len(best)] = dist[best]
+            I[row, :len(best)] = row_ids[best]
+        return D, I
+
+    def search(self, queries: np.ndarray, k: int, params=None):
+        short = min(self.ntotal, k * self.rerank)
+        _, ids = self.index.search(queries, short, params=params)
+        return self._exact(queries, ids, k)
+
+
+def parse_index_spec(spec) -> dict:
+    if isinstance(spec, dict):
+        kind, params = spec.get("kind", DEFAULT_INDEX_SPEC), dict(spec.get("params", {}))
+    else:
+        kind, _, raw = str(spec).strip().partition(":")
+        params = {}
+        for item in filter(None, (p.strip() for p in raw.split(","))):
+            key, _, value = item.partition("=")
+            params[key.strip()] = int(value)
+
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Неизвестный тип индекса: {kind} (доступны: {', '.join(INDEX_KINDS)})")
+    unknown = set(params) - set(DEFAULT_PARAMS[kind])
+    if unknown:
+        raise ValueError(f"Неизвестные параметры для {kind}: {', '.join(sorted(unknown))}")
+    return {"kind": kind, "params": {**DEFAULT_PARAMS[kind], **params}}
+
+
+def format_index_spec(spec) -> str:
+    spec = parse_index_spec(spec)
+    params = ",".join(f"{k}={v}" for k, v in spec["params"].items())
+    return f"{spec['kind']}:{params}" if params else spec["kind"]
+
+
+def build_faiss_index(vectors: np.ndarray, spec=DEFAULT_INDEX_SPEC):
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, d = vectors.shape
+    spec = parse_index_spec(spec)
+    kind, params = spec["kind"], spec["params"]
+
+    if kind in COMPACT_KINDS:
+        if kind == "PQ":
+            if d % params["m"]:
+                raise ValueError(f"PQ: размерность {d} не делится на m={params['m']}")
+            nbits = max(1, min(params["nbits"], int(math.log2(max(n, 2)))))
+            index = faiss.IndexPQ(d, params["m"], nbits)
+        else:
+            qtype = faiss.ScalarQuantizer.QT_8bit if kind == "SQ8" else faiss.ScalarQuantizer.QT_fp16
+            index = faiss.IndexScalarQuantizer(d, qtype, faiss.METRIC_L2)
+        index.train(vectors)
+        index.add(vectors)
+        return RerankedIndex(index, vectors, params["rerank"])
+
+    if kind == "Flat":
+        index = faiss.IndexFlatL2(d)
+    elif kind == "HNSW":
+        index = faiss.IndexHNSWFlat(d, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+        index.hnsw.efSearch = params["efSearch"]
+    else:
+        # k-means кластеризации нужно ~39 точек на кластер — на маленьком корпусе уменьшаем nlist
+        nlist = max(1, min(params["nlist"], n // 39))
+        if nlist != params["nlist"]:
+            print(f"⚠️ nlist уменьшен {params['nlist']} → {nlist} (векторов: {n})")
+        quantizer = faiss.IndexFlatL2(d)
+        if kind == "IVFFlat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            if d % params["m"]:
+                raise ValueError(f"IVFPQ: размерность {d} не делится на m={params['m']}")
+            nbits = max(1, min(params["nbits"], int(math.log2(max(n, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, params["m"], nbits)
+        index.train(vectors)
+        index.nprobe = min(params["nprobe"], nlist)
+
+    index.add(vectors)
+    if kind == "IVFPQ":
+        return RerankedIndex(index, vectors, params["rerank"])
+    return index
+
+
+def make_search_params(index, selector=None):
+    # Параметры поиска должны соответствовать типу индекса (иначе faiss бросает исключение)
+    if isinstance(index, RerankedIndex):
+        index = index.index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def exact_search_ids(index, queries: np.ndarray, k: int, ids) -> tuple:
+    # Точный L2-перебор строк ids по исходным (сохранённым или восстановленным) векторам
+    ids = np.sort(np.asarray(ids, dtype="int64"))  # последовательное чтение mmap
+    queries = np.asarray(queries, dtype="float32").reshape(-1, index.d)
+    D = np.full((len(queries), k), np.inf, dtype="float32")
+    I = np.full((len(queries), k), -1, dtype="int64")
+    if not len(ids) or not k:
+        return D, I
+    vectors = reconstruct_vectors(index, ids)
+    dist = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    best = np.argsort(dist, axis=1, kind="stable")[:, :k]
+    n = best.shape[1]
+    D[:, :n] = np.take_along_axis(dist, best, axis=1)
+    I[:, :n] = ids[best]
+    return D, I
+
+
+def search_allowed(index, queries: np.ndarray, k: int, allowed=None):
+    # Поиск только среди разрешённых id (None — без ограничений)
+    if allowed is None:
+        return index.search(queries, k)
+    if len(allowed) == 0:
+        return np.empty((len(queries), 0), dtype="float32"), np.empty((len(queries), 0), dtype="int64")
+    k = min(k, len(allowed))
+    if len(allowed) <= EXACT_FILTER_MAX or (isinstance(index, RerankedIndex) and isinstance(index.index, faiss.IndexPQ)):
+        return exact_search_ids(index, queries, k, allowed)
+    params = make_search_params(index, faiss.IDSelectorBatch(allowed))
+    D, I = index.search(queries, k, params=params)
+    # Крупный, но всё же выборочный фильтр мог не попасть в кандидатов: добираем точным перебором
+    short = (I < 0).any(axis=1)
+    if short.any():
+        D[short], I[short] = exact_search_ids(index, np.asarray(queries)[short], k, allowed)
+    return D, I
+
+
+def is_lossy_index(index) -> bool:
+    return isinstance(index, (faiss.IndexIVFPQ, faiss.IndexPQ, faiss.IndexScalarQuantizer,
+                              faiss.IndexIVFScalarQuantizer))
+
+
+def reconstruct_vectors(index, ids) -> np.ndarray:
+    # Исходные (для PQ/SQ/IVFPQ — сохранённые float) векторы строк ids
+    ids = np.asarray(ids, dtype="int64")
+    if isinstance(index, RerankedIndex):
+        return np.asarray(index.vectors[ids], dtype="float32")
+    if is_lossy_index(index):
+        # Декодированные коды дают заниженное сходство — пороги prune_hits на них не работают
+        raise ValueError("Индекс хранит только квантованные коды: пересоберите его, "
+                         "чтобы рядом сохранились float-векторы (.vectors.npy)")
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(ids) if len(ids) else np.zeros((0, index.d), "float32")
+
+
+def cosine_scores(index, query_vec: np.ndarray, ids) -> np.ndarray:
+    # Косинусное сходство вопроса с нормами — одна шкала для векторных и BM25-кандидатов
+    if not len(ids):
+        return np.zeros(0, dtype="float32")
+    vectors = reconstruct_vectors(index, ids)
+    q = np.asarray(query_vec, dtype="float32").ravel()
+    denom = np.linalg.norm(vectors, axis=1) * np.linalg.norm(q)
+    return (vectors @ q) / np.maximum(denom, 1e-12)
+
+
+def vectors_path(index_path: Path) -> Path:
+    return Path(index_path).with_suffix(".vectors.npy")
+
+
+def compact_meta_path(index_path: Path) -> Path:
+    return Path(index_path).with_suffix(".compact.json")
+
+
+def save_faiss_index(index, index_path: Path, spec=DEFAULT_INDEX_SPEC):
+    index_path = Path(index_path)
+    if not isinstance(index, RerankedIndex):
+        faiss.write_index(index, str(index_path))
+        compact_meta_path(index_path).unlink(missing_ok=True)
+        return
+
+    # Компактный режим: сначала проверяем, что квантование не испортило выдачу
+    # (IVFPQ — приближённый поиск, как HNSW/IVFFlat: его точность видна в отчёте recall)
+    compact = parse_index_spec(spec)["kind"] in COMPACT_KINDS
+    overlap = topk_overlap(index, np.asarray(index.vectors))
+    print(f"🔬 Совпадение top-{REPORT_TOP_K} с float-индексом: {overlap:.4f}"
+          + (f" (порог {COMPACT_MIN_OVERLAP})" if compact else ""))
+    if compact and overlap < COMPACT_MIN_OVERLAP:
+        raise ValueError(
+            f"Компактный индекс {format_index_spec(spec)} слишком неточен: "
+            f"{overlap:.4f} < {COMPACT_MIN_OVERLAP}. Увеличьте rerank или выберите SQ8/SQfp16."
+        )
+    faiss.write_index(index.index, str(index_path))
+    np.save(vectors_path(index_path), np.asarray(index.vectors, dtype="float32"))
+    with open(compact_meta_path(index_path), "w", encoding="utf-8") as f:
+        json.dump({"spec": format_index_spec(spec), "rerank": index.rerank, "min_overlap": overlap}, f)
+
+
+def read_faiss_index(index_path: Path, mmap: bool = False):
+    if not mmap:
+        return faiss.read_index(str(index_path))
+    # Коды индекса отображаются в память, а не копируются в кучу каждого процесса
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(str(index_path), flags)
+    except RuntimeError as e:
+        print(f"⚠️ mmap для {Path(index_path).name} не поддерживается ({e}), читаем в память")
+        return faiss.read_index(str(index_path))
+
+
+def load_faiss_index(index_path: Path, mmap: bool = False):
+    index_path = Path(index_path)
+    index = read_faiss_index(index_path, mmap)
+    meta_path = compact_meta_path(index_path)
+    if not meta_path.exists():
+        return index
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    vectors = np.load(vectors_path(index_path), mmap_mode="r")
+    return RerankedIndex(index, vectors, meta["rerank"])
+
+
+def topk_overlap(index, vectors: np.ndarray, k=REPORT_TOP_K, n_queries=REPORT_QUERIES) -> float:
+    # Доля общих id в top-k компактного и точного float-поиска
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = sample_report_queries(vectors, n_queries)
+    return evaluate_index(index, vectors, queries, k)["recall_at_k"]
+
+
+def sample_report_queries(vectors: np.ndarray, n_queries=REPORT_QUERIES, seed=0) -> np.ndarray:
+    # Запросы — случайные векторы корпуса с небольшим шумом, чтобы не искать точные дубли
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    noise = rng.normal(0, vectors.std() * 0.1, size=(len(ids), vectors.shape[1]))
+    return (vectors[ids] + noise).astype("float32")
+
+
+def evaluate_index(index, vectors: np.ndarray, queries: np.ndarray, k=REPORT_TOP_K, exact_ids=None) -> dict:
+    k = min(k, len(vectors))
+    if exact_ids is None:
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(np.ascontiguousarray(vectors, dtype="float32"))
+        _, exact_ids = exact.search(queries, k)
+
+    latencies = []
+    found = []
+    for q in queries:
+        started = time.perf_counter()
+        _, I = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append(I[0])
+
+    recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact_ids)])
+    return {
+        "k": k,
+        "queries": len(queries),
+        "recall_at_k": round(float(recall), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+        "latency_ms_mean": round(float(np.mean(latencies)), 4),
+    }
+
+
+def report_index_specs(vectors: np.ndarray, specs: list, k=REPORT_TOP_K, n_queries=REPORT_QUERIES) -> list:
+    # Сравнение нескольких конфигураций с точным Flat-поиском на одних и тех же запросах
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = sample_report_queries(vectors, n_queries)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, exact_ids = exact.search(queries, min(k, len(vectors)))
+
+    rows = []
+    for spec in specs:
+        started = time.perf_counter()
+        index = build_faiss_index(vectors, spec)
+        build_s = time.perf_counter() - started
+        row = {
+            "spec": format_index_spec(spec),
+            "ntotal": int(index.ntotal),
+            "build_s": round(build_s, 3),
+            "resident_mb": round(resident_bytes(index) / 2 ** 20, 3),
+        }
+        row.update(evaluate_index(index, vectors, queries, k, exact_ids))
+        rows.append(row)
+    return rows
+
+
+def resident_bytes(index) -> int:
+    # Размер индекса в памяти процесса (float-векторы компактного режима лежат в mmap)
+    if isinstance(index, RerankedIndex):
+        index = index.index
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def print_index_report(rows: list):
+    print(f"{'spec':<50} {'recall@k':>9} {'p50 ms':>9} {'p95 ms':>9} {'build s':>8} {'RAM MB':>8}")
+    for r in rows:
+        print(f"{r['spec']:<50} {r['recall_at_k']:>9.4f} {r['latency_ms_p50']:>9.4f} "
+              f"{r['latency_ms_p95']:>9.4f} {r['build_s']:>8.3f} {r['resident_mb']:>8.3f}")
+
+
+def index_report_path(index_path: Path) -> Path:
+    return Path(index_path).with_suffix(".report.json")
+
+
+def save_index_report(vectors: np.ndarray, spec, index_path: Path, k=REPORT_TOP_K) -> list:
+    # Отчёт по выбранной конфигурации (Flat добавляется как точка отсчёта)
+    specs = [DEFAULT_INDEX_SPEC] if parse_index_spec(spec)["kind"] == "Flat" else [DEFAULT_INDEX_SPEC, spec]
+    rows = report_index_specs(vectors, specs, k)
+    print_index_report(rows)
+    path = index_report_path(index_path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+    print(f"📈 Отчёт recall/latency: {path}")
+    return rows
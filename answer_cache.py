@@ -0,0 +1,163 @@
+# answer_cache.py
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from norm_rag import NO_FILTER_VALUES, normalize_room_type, split_facet_values
+
+BASE_DIR = Path(__file__).resolve().parent
+ANSWER_CACHE_PATH = BASE_DIR / "index" / "answer_cache.sqlite"
+ANSWER_CACHE_THRESHOLD = 0.92   # косинусное сходство вопросов, с которого ответ считается готовым
+
+
+def answer_filters_key(source=None, domain=None, applies_to=None) -> str:
+    # Те же правила, что и в NormRAG._allowed_ids: пустые и "— Все —" фильтра не задают
+    def values(v):
+        v = [v] if isinstance(v, str) else v
+        return sorted({x for x in split_facet_values(v) if x not in NO_FILTER_VALUES})
+
+    room = normalize_room_type(applies_to) if applies_to and applies_to.strip() else ""
+    return json.dumps({"source": values(source), "domain": values(domain), "applies_to": room},
+                      ensure_ascii=False, sort_keys=True)
+
+
+def _normalized(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype="float32").reshape(1, -1).copy()
+    faiss.normalize_L2(vector)
+    return vector
+
+
+# Кэш готовых ответов: похожий вопрос с теми же фильтрами на той же версии индекса
+# получает сохранённый ответ и список норм без обращения к LLM
+class AnswerCache:
+    def __init__(self, db_path: Path = ANSWER_CACHE_PATH, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self.index_version = None
+        self._lock = threading.Lock()
+        self._indexes = {}       # filters_key -> (faiss.IndexFlatIP, [row id])
+        self.hits = 0
+        self.misses = 0
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY, index_version TEXT, filters TEXT NOT NULL,"
+            " question TEXT NOT NULL, vector BLOB NOT NULL, answer TEXT NOT NULL,"
+            " text_norms TEXT NOT NULL, table_norms TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def _rebuild(self):
+        # Индексы по фильтрам маленькие — проще пересобрать целиком, чем удалять векторы
+        self._indexes = {}
+        rows = self._db.execute(
+            "SELECT id, filters, vector FROM answers WHERE index_version IS ?", (self.index_version,)
+        ).fetchall()
+        for row_id, filters, blob in rows:
+            self._add_vector(filters, row_id, np.frombuffer(blob, dtype="float32"))
+
+    def _add_vector(self, filters: str, row_id: int, vector: np.ndarray):
+        vector = _normalized(vector)
+        if filters not in self._indexes:
+            self._indexes[filters] = (faiss.IndexFlatIP(vector.shape[1]), [])
+        index, ids = self._indexes[filters]
+        index.add(vector)
+        ids.append(row_id)
+
+    def set_index_version(self, index_version: str):
+        with self._lock:
+            if index_version == self.index_version:
+                return
+            self.index_version = index_version
+            removed = self._db.execute(
+                "DELETE FROM answers WHERE index_version IS NOT ?", (index_version,)
+            ).rowcount
+            self._db.commit()
+            self._rebuild()
+        if removed:
+            print(f"🧹 Кэш ответов: удалено {removed} ответов старой версии индекса")
+
+    def lookup(self, vector, filters: str):
+        with self._lock:
+            entry = self._indexes.get(filters)
+            if entry is None or entry[0].ntotal == 0:
+                self.misses += 1
+                return None
+            index, ids = entry
+            D, I = index.search(_normalized(vector), 1)
+            if I[0][0] < 0 or D[0][0] < self.threshold:
+                self.misses += 1
+                return None
+            row = self._db.execute(
+                "SELECT question, answer, text_norms, table_norms FROM answers WHERE id = ?",
+                (ids[I[0][0]],),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {
+            "question": row[0],
+            "answer": row[1],
+            "text_norms": json.loads(row[2]),
+            "table_norms": json.loads(row[3]),
+            "similarity": float(D[0][0]),
+        }
+
+    def add(self, question: str, vector, filters: str, answer: str, text_norms: list, table_norms: list):
+        vector = np.asarray(vector, dtype="float32").ravel()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO answers (index_version, filters, question, vector, answer, text_norms,"
+                " table_norms, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.index_version, filters, question, vector.tobytes(), answer,
+                    json.dumps(text_norms, ensure_ascii=False, default=str),
+                    json.dumps(table_norms, ensure_ascii=False, default=str),
+                    time.time(),
+                ),
+            )
+            self._db.commit()
+            self._add_vector(filters, cursor.lastrowid, vector)
+
+    def evict(self, question: str, answer: str) -> int:
+        # 👎: убираем и сам вопрос, и ответ, если он был отдан на перефразированный вопрос
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM answers WHERE question = ? OR answer = ?", (question, answer)
+            ).rowcount
+            self._db.commit()
+            if removed:
+                self._rebuild()
+        if removed:
+            print(f"🗑️ Кэш ответов: удалено {removed} ответов с отрицательной оценкой")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "items": sum(index.ntotal for index, _ in self._indexes.values()),
+                "index_version": self.index_version,
+            }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = AnswerCache()
+        return _shared_cache
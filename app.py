@@ -1,11 +1,18 @@
 import streamlit as st
 from pathlib import Path
-import re
-from norm_rag import NormRAG
+from norm_rag import NormRAG, norm_index_version
+from norm_catalog import NormCatalog
+from llm_response_cache import get_response_cache
+from answer_cache import get_answer_cache, answer_filters_key
+from single_flight import get_single_flight, flight_key
 from read_docx import check_multi_norms_combined_with_llama_parallel
 from log_feedback import log_feedback
 from scripts.search_class_norms import search as search_table_norms
 from new_model_check import  check_multi_norms_mistral_nemo_parallel4 as check_multi_norms_mistral_nemo
+from new_model_check import format_text_norm, format_table_norm
+from model_routing import FALLBACK_ROUTES, MODEL_ROUTES
+from prompt_packer import count_tokens, preload_tokenizers
+from norm_pruning import prune_hits
 import json
 from scripts.extract_from_one_docx import extract_general_norms
 from scripts.extract_class_norms import extract_from_docx_and_save
@@ -14,44 +21,54 @@ from scripts.merge_new_with_existing import merge_and_save
 from scripts.rebuild_faiss_index import rebuild_index_from_norms
 from scripts.index_class_norms import build_class_norms_index
 import tempfile
+import uuid
+from llm_admission import set_llm_session, get_admission_controller
 # === Настройки ===
 BASE_DIR = Path(__file__).resolve().parent
-RAG = NormRAG(base_dir=BASE_DIR, source_file="norms_checklist_merged.json")
-available_domains = sorted({n.get("domain") for n in RAG.norms if n.get("domain")})
+# Гибридный поиск (BM25 + векторы) находит нужные пункты в более коротком списке
+TEXT_TOP_K = 32
+TABLE_TOP_K = 15
+NORMS_FILE = "norms_checklist_merged.json"
+
+# Индекс норм (FAISS, BM25, словари) загружается один раз на версию индекса, а не на каждый rerun
+@st.cache_resource(show_spinner=False)
+def load_norm_rag(index_version: str) -> NormRAG:
+    return NormRAG(base_dir=BASE_DIR, source_file=NORMS_FILE)
+
+RAG = load_norm_rag(norm_index_version(BASE_DIR, NORMS_FILE))
+# Ответы LLM, полученные на другой версии индекса норм, из кэша больше не отдаются
+get_response_cache().set_index_version(RAG.index_version)
+ANSWER_CACHE = get_answer_cache()
+ANSWER_CACHE.set_index_version(RAG.index_version)
+
+# Справочник норм строится один раз на версию индекса, а не на каждый rerun
+@st.cache_resource(show_spinner=False)
+def load_norm_catalog(index_version: str) -> NormCatalog:
+    return NormCatalog(RAG.norms)
+
+CATALOG = load_norm_catalog(RAG.index_version)
+# Токенизаторы моделей загружаются при старте, а не во время первого вопроса
+preload_tokenizers(set(MODEL_ROUTES.values()) | set(FALLBACK_ROUTES.values()))
 
 st.set_page_config(page_title="AI для Архитекторов", layout="wide")
 
+# Все вызовы LLM этой сессии идут в её очередь общего контроллера допуска
+if "llm_session" not in st.session_state:
+    st.session_state["llm_session"] = uuid.uuid4().hex[:8]
+set_llm_session(st.session_state["llm_session"])
+
+with st.sidebar.expander("🚦 Нагрузка на LLM"):
+    st.json(get_admission_controller().stats())
+
 # === Функция для преобразования ссылок в ответе ===
 def linkify_norm_refs(text, current_sources):
-    # Если передан не список — сделаем списком
-    if not isinstance(current_sources, list):
-        current_sources = [current_sources]
-
-    def replace(match):
-        norm_id = match.group(0)
-        matched_norm = next(
-            (
-                norm for norm in RAG.norms
-                if any(src.strip() == norm.get("source", "").strip() for src in current_sources)
-                and norm.get("full_id", "").endswith(f":{norm_id}")
-            ),
-            None
-        )
-
-        if matched_norm:
-            source = matched_norm.get("source", "").strip()
-            tooltip = matched_norm.get("text", "").replace('"', "'").replace("\n", " ")
-            return f'<a href="?norm_id={norm_id}" title="{tooltip}"><b>{source}:{norm_id}</b></a>'
-
-        return norm_id  # если не нашли, возвращаем как есть
-
-    return re.sub(r'\b\d{1,2}(?:\.\d{1,2}){1,4}\b', replace, text)
+    return CATALOG.linkify(text, current_sources)
 
 # === Обработка перехода по ссылке на конкретную норму ===
 query_params = st.query_params
 norm_id = query_params.get("norm_id")
 if norm_id:
-    norm = next((n for n in RAG.norms if n.get("full_id", "").endswith(norm_id)), None)
+    norm = CATALOG.find(norm_id)
     st.title(f"📄 Норма {norm_id}")
     if norm:
         st.markdown(f"**Источник**: `{norm.get('source', 'неизвестен')}`")
@@ -110,18 +127,13 @@ if uploaded_file:
 st.title("📐 AI помощник по архитектурным нормам")
 
 question = st.text_input("Введите вопрос архитектора (например, 'как проектировать лестницу?')")
-available_sources = sorted(set(n.get("source") for n in RAG.norms if n.get("source")))
+available_sources = CATALOG.sources
 
-all_sources_raw = [n.get("source", "") for n in RAG.norms if n.get("source")]
 selected_sources = st.multiselect("📄 Выберите документ (источник)",  ["— Все —"] +available_sources)
-split_sources = [d.strip() for dom in all_sources_raw for d in dom.split(",")]
-available_sources = sorted(set(split_sources))
 source_filter = selected_sources if selected_sources != "— Все —" else None
 
 applies_to = st.text_input("Тип помещения (опционально)", placeholder="лестница, коридор, кухня...")
-all_domains_raw = [n.get("domain", "") for n in RAG.norms if n.get("domain")]
-split_domains = [d.strip() for dom in all_domains_raw for d in dom.split(",")]
-available_domains = sorted(set(split_domains))
+available_domains = CATALOG.domains
 
 # Выбор нескольких доменов
 selected_domains = st.multiselect("Выберите одну или несколько сфер", available_domains)
@@ -133,33 +145,86 @@ if st.button("🔍 Получить ответ"):
     if not question.strip():
         st.warning("Введите вопрос.")
     else:
-        with st.spinner("🔎 Идёт поиск по нормативам..."):
-            text_norms = RAG.query(question, top_k=64, applies_to=applies_to, domain=domains,source=source_filter)
-            table_norms = search_table_norms(question, top_k=30)  # табличные нормы
+        # Похожий вопрос с теми же фильтрами уже отвечен — берём готовый ответ без LLM
+        question_vec = RAG.embed_questions([question])[0]
+        cache_filters = answer_filters_key(source_filter, domains, applies_to)
+        cached = ANSWER_CACHE.lookup(question_vec, cache_filters)
 
-        if not text_norms and not table_norms:
-            st.error("❌ Ничего не найдено ни в текстовых, ни в табличных нормативах.")
+        if cached:
+            st.info(f"♻️ Ответ на похожий вопрос «{cached['question']}» (сходство {cached['similarity']:.2f})")
+            st.session_state["last_question"] = question
+            st.session_state["last_answer"] = cached["answer"]
+            st.session_state["last_text_norms"] = cached["text_norms"]
+            st.session_state["last_table_norms"] = cached["table_norms"]
+            st.session_state["last_omitted"] = []
         else:
+            # Поиск текстовых и табличных норм идёт параллельно с генерацией: map-вызовы
+            # стартуют, как только готовы батчи одного вида
+            retrieved = {}
+
+            def retrieve_text_norms():
+                text_hits = RAG.query(question, top_k=TEXT_TOP_K, applies_to=applies_to, domain=domains,source=source_filter,
+                                      with_scores=True)
+                # Слабые совпадения отсекаются до LLM: порог, разрыв в оценках, доля массы
+                retrieved["text"], retrieved["text_report"] = prune_hits(
+                    text_hits, tokens_fn=lambda n: count_tokens(format_text_norm(n), MODEL_ROUTES["map_text"]))
+                return retrieved["text"]
+
+            def retrieve_table_norms():
+                table_hits = search_table_norms(question, top_k=TABLE_TOP_K, with_scores=True)  # табличные нормы
+                retrieved["table"], retrieved["table_report"] = prune_hits(
+                    table_hits, tokens_fn=lambda n: count_tokens(format_table_norm(n), MODEL_ROUTES["map_table"]))
+                return retrieved["table"]
+
+            # Одинаковый вопрос с теми же фильтрами, уже считающийся в другой сессии, не
+            # запускается повторно: эта сессия получает его прогресс и результат
+            def answer_question(progress_bar, progress_label, answer_placeholder):
+                answer = check_multi_norms_mistral_nemo(
+                    text_norms=retrieve_text_norms,
+                    table_norms=retrieve_table_norms,
+                    fact_text=question,
+                    sourse=source_filter,
+                    progress_bar=progress_bar,
+                    progress_label=progress_label,
+                    answer_placeholder=answer_placeholder,
+                    report=retrieved
+                )
+                return {**retrieved, "answer": answer}
+
             progress_label = st.empty()
             progress_bar = st.progress(0.0)
-            progress_label.text("🚀 Генерация ответа...")
-
-            answer = check_multi_norms_mistral_nemo(
-                text_norms=text_norms,
-                table_norms=table_norms,
-                fact_text=question,
-                sourse=source_filter,
-                progress_bar=progress_bar,
-                progress_label=progress_label
+            answer_stream = st.empty()
+            progress_label.text("🔎 Поиск по нормативам и генерация ответа...")
+
+            outcome, joined = get_single_flight().run(
+                flight_key(question, cache_filters, RAG.index_version), answer_question,
+                progress_bar=progress_bar, progress_label=progress_label, answer_placeholder=answer_stream,
             )
+            answer = outcome["answer"]
 
             progress_bar.empty()
-            
-    
-            st.session_state["last_question"] = question
-            st.session_state["last_answer"] = answer
-            st.session_state["last_text_norms"] = text_norms
-            st.session_state["last_table_norms"] = table_norms
+            answer_stream.empty()
+
+            text_norms = outcome.get("text", [])
+            table_norms = outcome.get("table", [])
+            text_report = outcome.get("text_report", {})
+            table_report = outcome.get("table_report", {})
+            print(f"✂️ «{question}»: текстовых норм {text_report.get('kept', 0)}/{text_report.get('retrieved', 0)} "
+                  f"({text_report.get('reason') or 'без отсечения'}), табличных {table_report.get('kept', 0)}/{table_report.get('retrieved', 0)} "
+                  f"({table_report.get('reason') or 'без отсечения'}), сэкономлено "
+                  f"{text_report.get('tokens_saved', 0) + table_report.get('tokens_saved', 0)} токенов")
+
+            if not text_norms and not table_norms:
+                st.error("❌ Ничего не найдено ни в текстовых, ни в табличных нормативах.")
+            else:
+                st.session_state["last_question"] = question
+                st.session_state["last_answer"] = answer
+                st.session_state["last_text_norms"] = text_norms
+                st.session_state["last_table_norms"] = table_norms
+                st.session_state["last_omitted"] = outcome.get("omitted", [])
+                # Неполный ответ (часть батчей не дождались) не кэшируется
+                if not joined and not outcome.get("omitted") and answer and not answer.lstrip().startswith(("❌", "❗")):
+                    ANSWER_CACHE.add(question, question_vec, cache_filters, answer, text_norms, table_norms)
 
 
 # === Отображение ответа, если он есть ===
@@ -172,6 +237,18 @@ if "last_answer" in st.session_state and st.session_state["last_answer"]:
     st.success("✅ Ответ:")
     st.markdown(linkify_norm_refs(final_response,source_filter), unsafe_allow_html=True)
 
+    omitted = st.session_state.get("last_omitted", [])
+    if omitted:
+        with st.expander(f"⚠️ Ответ неполный: {len(omitted)} блок(ов) норм не учтено"):
+            for batch in omitted:
+                kind = "📘 текстовые" if batch["kind"] == "text" else "📊 табличные"
+                if batch["kind"] == "reduce":
+                    st.markdown(f"**Финальный ответ** — {batch['reason']}")
+                elif batch["norms"]:
+                    st.markdown(f"**Блок {batch['index']}** ({kind}, {batch['reason']}): {', '.join(batch['norms'])}")
+                else:
+                    st.markdown(f"**Все {kind} нормы** — {batch['reason']}")
+
     with st.expander("📄 Использованные нормы"):
         text_norms = st.session_state.get("last_text_norms", [])
         table_norms = st.session_state.get("last_table_norms", [])
@@ -1,20 +1,23 @@
 # class_norms_rag.py
-import faiss
-import pickle
 from pathlib import Path
 from typing import List, Dict, Any
-from model_loader import load_sentence_transformer_model  
+from model_loader import load_sentence_transformer_model, DEFAULT_MODEL_NAME
+from embedding_cache import get_query_embedding_cache
+from ann_index import load_faiss_index
+from norm_store import load_records, fetch_rows, DEFAULT_LOAD_MODE
 
 class ClassNormsRAG:
     def __init__(
         self,
         index_path: str = "index/class_norms.index",
         meta_path: str = "index/class_norms_meta.pkl",
-        model_name: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        model_name: str = DEFAULT_MODEL_NAME,
+        load_mode: str = DEFAULT_LOAD_MODE
     ):
         self.index_path = Path(index_path)
         self.meta_path = Path(meta_path)
         self.model_name = model_name
+        self.load_mode = load_mode
 
         self._load_index()
         self._load_metadata()
@@ -22,28 +25,27 @@ class ClassNormsRAG:
 
     def _load_index(self):
         print(f"📦 Загружаем индекс: {self.index_path}")
-        self.index = faiss.read_index(str(self.index_path))
+        self.index = load_faiss_index(self.index_path, mmap=self.load_mode != "heap")
 
     def _load_metadata(self):
         print(f"🧠 Загружаем мета-данные: {self.meta_path}")
-        with open(self.meta_path, "rb") as f:
-            self.metadata = pickle.load(f)
+        self.metadata = load_records(self.meta_path, self.load_mode)
     
     def _load_model(self):
         print(f"🤖 Загружаем модель: {self.model_name}")
         self.model = load_sentence_transformer_model(self.model_name)
+        self.embedding_cache = get_query_embedding_cache()
 
 
     def query(self, text: str, top_k: int = 3,domain: str = None) -> List[Dict[str, Any]]:
-        embedding = self.model.encode([text])
+        embedding = self.embedding_cache.encode(self.model, [text], self.model_name)
         distances, indices = self.index.search(embedding, top_k)
 
+        items = fetch_rows(self.metadata, [idx for idx in indices[0] if 0 <= idx < len(self.metadata)])
         results = []
-        for idx in indices[0]:
-            if idx < len(self.metadata):
-                item = self.metadata[idx]
-                if domain is None or item.get("domain") == domain:
-                    results.append(item)
+        for item in items:
+            if domain is None or item.get("domain") == domain:
+                results.append(item)
             if len(results) >= top_k:
                 break
         return results
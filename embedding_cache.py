@@ -0,0 +1,117 @@
+# embedding_cache.py
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_DB_PATH = BASE_DIR / "index" / "query_embeddings.sqlite"
+MEMORY_MAX_ITEMS = 4096
+
+
+def normalize_query_text(text: str) -> str:
+    # Одинаковые по смыслу написания (лишние пробелы, разные формы Unicode) дают один ключ
+    return " ".join(unicodedata.normalize("NFC", str(text)).split())
+
+
+# Кэш эмбеддингов запросов: LRU в памяти + (опционально) SQLite на диске
+class QueryEmbeddingCache:
+    def __init__(self, max_items: int = MEMORY_MAX_ITEMS, db_path: Path = None):
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path is not None:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text))"
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return vector
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text = ?", key
+            ).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype="float32")
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    def encode(self, model, texts: list, model_name: str) -> np.ndarray:
+        # Кодирует только то, чего нет в кэше, — одним батчем
+        texts = [normalize_query_text(t) for t in texts]
+        keys = [(model_name, t) for t in texts]
+
+        with self._lock:
+            vectors = [self._lookup(key) for key in keys]
+
+        missing = list(dict.fromkeys(key for key, vec in zip(keys, vectors) if vec is None))
+        if missing:
+            encoded = np.asarray(model.encode([text for _, text in missing]), dtype="float32")
+            fresh = dict(zip(missing, encoded))
+            with self._lock:
+                for key, vector in fresh.items():
+                    self._remember(key, vector)
+                if self._db is not None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, text, vector) VALUES (?, ?, ?)",
+                        [(m, t, vec.tobytes()) for (m, t), vec in fresh.items()],
+                    )
+                    self._db.commit()
+            vectors = [vec if vec is not None else fresh[key] for key, vec in zip(keys, vectors)]
+
+        if not vectors:
+            return np.zeros((0, model.get_sentence_embedding_dimension()), dtype="float32")
+        return np.stack(vectors)
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    # Один кэш на процесс — общий для NormRAG, ClassNormsRAG и search_class_norms
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = QueryEmbeddingCache(db_path=CACHE_DB_PATH)
+        return _shared_cache
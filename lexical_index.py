@@ -0,0 +1,179 @@
+# lexical_index.py
+import re
+from pathlib import Path
+
+import numpy as np
+
+# BM25 по нормализованным русским токенам: номера пунктов ("4.2.6"), классы ("ii"),
+# числа с единицами ("2.7", "м") сохраняются как отдельные точные токены
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[a-zа-я]+", re.IGNORECASE)
+# Окончания для лёгкого стемминга (от длинных к коротким)
+RU_ENDINGS = sorted(
+    [
+        "иями", "ями", "ами", "ией", "иях", "ях", "ах", "ого", "его", "ому", "ему",
+        "ыми", "ими", "ой", "ей", "ый", "ий", "ая", "яя", "ое", "ее", "ые", "ие", "ых", "их",
+        "ую", "юю", "ом", "ем", "ам", "ям", "ов", "ев", "ию", "ия", "ью",
+        "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+    ],
+    key=len,
+    reverse=True,
+)
+MIN_STEM = 3
+
+
+def stem_ru(word: str) -> str:
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[: -len(ending)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for token in TOKEN_RE.findall(str(text).lower().replace("ё", "е")):
+        if token[0].isdigit():
+            tokens.append(token.replace(",", "."))  # "2,7" и "2.7" — один токен
+        else:
+            tokens.append(stem_ru(token))
+    return tokens
+
+
+def lexical_text(record: dict) -> str:
+    # Поля текстовых и табличных норм, по которым ищем точные совпадения
+    parts = [record.get(k) for k in ("id", "text", "condition", "requirement", "check", "indicator", "domain")]
+    full_id = record.get("full_id") or ""
+    parts.append(full_id.rsplit(":", 1)[-1])
+    applies = record.get("applies_to")
+    if isinstance(applies, list):
+        parts.extend(applies)
+    else:
+        parts.append(applies)
+    values = record.get("values")
+    if isinstance(values, dict):
+        parts.extend(f"{k} {v}" for k, v in values.items())
+    return " ".join(str(p) for p in parts if p)
+
+
+def lexical_index_path(path: Path) -> Path:
+    return Path(path).with_suffix(".bm25.npz")
+
+
+class BM25Index:
+    def __init__(self, terms, indptr, doc_ids, tfs, doc_lens):
+        self.terms = {t: i for i, t in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.index_version = None
+        n_docs = len(doc_lens)
+        df = np.diff(indptr)
+        self.idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = doc_lens.mean() if n_docs else 1.0
+        self.norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_lens / max(avgdl, 1e-9))).astype("float32")
+
+    @classmethod
+    def build(cls, records) -> "BM25Index":
+        postings = {}
+        doc_lens = []
+        for doc_id, record in enumerate(records):
+            tokens = tokenize(lexical_text(record))
+            doc_lens.append(len(tokens))
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                postings.setdefault(t, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        indptr = [0]
+        doc_ids, tfs = [], []
+        for t in terms:
+            for doc_id, tf in postings[t]:
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+            indptr.append(len(doc_ids))
+        return cls(
+            terms,
+            np.array(indptr, dtype="int64"),
+            np.array(doc_ids, dtype="int64"),
+            np.array(tfs, dtype="float32"),
+            np.array(doc_lens, dtype="float32"),
+        )
+
+    def save(self, path: Path, index_version: str = None):
+        # index_version — версия индекса, по записям которого построен BM25 (проверяется при загрузке)
+        terms = sorted(self.terms, key=self.terms.get)
+        self.index_version = index_version
+        np.savez(
+            path, terms=np.array(terms, dtype=str), indptr=self.indptr,
+            doc_ids=self.doc_ids, tfs=self.tfs, doc_lens=self.doc_lens,
+            index_version=np.array(index_version or "", dtype=str),
+        )
+        print(f"🔤 BM25-индекс сохранён: {path} ({len(terms)} терминов)")
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with np.load(path) as data:
+            index = cls(list(data["terms"]), data["indptr"], data["doc_ids"], data["tfs"], data["doc_lens"])
+            index.index_version = str(data["index_version"]) if "index_version" in data else ""
+        return index
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.doc_lens), dtype="float32")
+        for t in set(tokenize(query)):
+            term_id = self.terms.get(t)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs, tf = self.doc_ids[start:end], self.tfs[start:end]
+            scores[docs] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + self.norm[docs])
+        return scores
+
+    def search(self, query: str, top_k: int, allowed=None):
+        # Возвращает (scores, ids) лучших документов с ненулевым счётом
+        scores = self.scores(query)
+        if allowed is not None:
+            mask = np.zeros(len(scores), dtype=bool)
+            mask[allowed] = True
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return scores[order], order
+
+
+def load_or_build_bm25(path: Path, records, index_version: str = None) -> BM25Index:
+    # index_version задан — BM25 другой версии индекса перестраивается, даже если число записей то же
+    index_path = lexical_index_path(path)
+    if index_path.exists():
+        index = BM25Index.load(index_path)
+        if len(index) == len(records) and (index_version is None or index.index_version == index_version):
+            return index
+    print(f"⚠️ BM25-индекс не найден или устарел, строим: {index_path}")
+    index = BM25Index.build(records)
+    # Сохраняем, чтобы следующий запуск не строил его заново
+    try:
+        index.save(index_path, index_version)
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить BM25-индекс ({e})")
+    return index
+
+
+def reciprocal_rank_fusion(rankings: list, top_k: int, k: int = RRF_K, weights=None) -> list:
+    # rankings — списки id в порядке убывания релевантности
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking):
+            doc_id = int(doc_id)
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank + 1)
+    return sorted(fused, key=lambda d: (-fused[d], d))[:top_k]
@@ -0,0 +1,213 @@
+# llm_admission.py
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+ADMISSION_INITIAL = 2          # стартовый лимит одновременных вызовов на весь процесс
+ADMISSION_MIN = 1
+ADMISSION_MAX = 8
+LATENCY_TOLERANCE = 2.0        # время генерации на токен выше baseline * это — бэкенд перегружен
+BASELINE_DRIFT = 0.01          # baseline медленно «забывает» старый минимум
+DECREASE_FACTOR = 0.7          # мультипликативное уменьшение лимита
+DECREASE_COOLDOWN = 5.0        # сек. между уменьшениями — одна перегрузка не режет лимит много раз
+THROUGHPUT_WINDOW = 60.0       # сек. окна для пропускной способности
+METRICS_WINDOW = 1000          # последних ожиданий/задержек в метриках
+CANCEL_POLL = 0.1              # сек. между проверками отмены у ожидающего вызова
+
+_session = contextvars.ContextVar("llm_session", default="default")
+_cancel = contextvars.ContextVar("llm_cancel", default=None)
+_priority = contextvars.ContextVar("llm_priority", default=False)
+
+
+class LLMCancelled(Exception):
+    pass
+
+
+class _Waiter:
+    # Сравнивается по identity: отменённый ожидающий удаляется из очереди именно он
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+def set_llm_session(session_id: str):
+    # Вызовы LLM из этого потока (и asyncio.to_thread из него) идут в очередь этой сессии
+    return _session.set(session_id)
+
+
+def current_llm_session() -> str:
+    return _session.get()
+
+
+def set_llm_cancel(event):
+    # threading.Event: после set() вызовы из этого контекста не ждут слот и не отправляются
+    return _cancel.set(event)
+
+
+def current_llm_cancel():
+    return _cancel.get()
+
+
+def reset_llm_cancel(token):
+    _cancel.reset(token)
+
+
+def set_llm_priority(priority: bool):
+    # Приоритетные вызовы (финальный reduce) получают слот раньше всех очередей сессий
+    return _priority.set(priority)
+
+
+def reset_llm_priority(token):
+    _priority.reset(token)
+
+
+# Общий для процесса допуск вызовов к Ollama: AIMD-лимит по задержке на токен,
+# очередь с честной (round-robin) очерёдностью между сессиями и метрики ожидания
+class AdmissionController:
+    def __init__(self, initial=ADMISSION_INITIAL, min_limit=ADMISSION_MIN, max_limit=ADMISSION_MAX):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.admitted = 0
+        self.decreases = 0
+        self.baseline = None
+        self._saturated = 0            # вызовов в работе, допущенных при полностью занятом лимите
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()   # сессия -> очередь ожидающих; порядок = очередь обхода
+        self._urgent = deque()         # приоритетные ожидающие, обслуживаются первыми
+        self._last_decrease = float("-inf")
+        self._waits = deque(maxlen=METRICS_WINDOW)
+        self._latencies = deque(maxlen=METRICS_WINDOW)
+        self._completed = deque()
+
+    def _dispatch(self):
+        # Свободные слоты раздаются сессиям по кругу: одна сессия с 10 батчами
+        # не задерживает вызовы других сессий
+        granted = False
+        while self.in_flight < int(self.limit) and (self._urgent or self._queues):
+            if self._urgent:
+                waiter = self._urgent.popleft()
+            else:
+                session, queue = next(iter(self._queues.items()))
+                waiter = queue.popleft()
+                del self._queues[session]
+                if queue:
+                    self._queues[session] = queue
+            waiter.granted = True
+            self.in_flight += 1
+            self.admitted += 1
+            # Лимит исчерпан (или за ним есть очередь) — только такие вызовы дают повод его поднять
+            if self.in_flight >= int(self.limit) or self._urgent or self._queues:
+                self._saturated += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _withdraw(self, session: str, waiter: _Waiter):
+        if waiter in self._urgent:
+            self._urgent.remove(waiter)
+            return
+        queue = self._queues.get(session)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[session]
+
+    def acquire(self, session: str = None, cancel=None, priority: bool = None) -> float:
+        # cancel — threading.Event: отменённый вызов уходит из очереди с LLMCancelled
+        session = session or current_llm_session()
+        cancel = cancel if cancel is not None else current_llm_cancel()
+        priority = _priority.get() if priority is None else priority
+        waiter = _Waiter()
+        started = time.perf_counter()
+        with self._cond:
+            if priority:
+                self._urgent.append(waiter)
+            else:
+                self._queues.setdefault(session, deque()).append(waiter)
+            self._dispatch()
+            while not waiter.granted:
+                if cancel is not None and cancel.is_set():
+                    self._withdraw(session, waiter)
+                    raise LLMCancelled("вызов отменён до получения слота")
+                self._cond.wait(CANCEL_POLL if cancel is not None else None)
+            waited = time.perf_counter() - started
+            self._waits.append(waited)
+        return waited
+
+    def _decrease(self, now: float):
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        print(f"🚦 LLM перегружен — лимит параллельности снижен до {self.limit:.1f}")
+
+    def release(self, latency_s: float, ok: bool = True, tokens: int = None, eval_s: float = None):
+        # tokens / eval_s — eval_count и eval_duration ответа Ollama: время генерации на токен
+        # не зависит от длины промпта (prompt eval) и сравнимо между map и reduce.
+        # Без eval_s берётся полная задержка вызова. Лимит растёт только от вызовов, допущенных
+        # при насыщении: последовательные вызовы одного пользователя его не раскручивают
+        now = time.perf_counter()
+        with self._cond:
+            self.in_flight -= 1
+            saturated = self._saturated > 0
+            if saturated:
+                self._saturated -= 1
+            self._latencies.append(latency_s)
+            self._completed.append(now)
+            if not ok:
+                self._decrease(now)
+            elif tokens:
+                sample = (eval_s if eval_s else latency_s) / tokens
+                if self.baseline is None:
+                    self.baseline = sample
+                self.baseline = min(sample, self.baseline * (1 + BASELINE_DRIFT))
+                if sample > self.baseline * LATENCY_TOLERANCE:
+                    self._decrease(now)
+                elif saturated:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._dispatch()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._urgent) + sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        now = time.perf_counter()
+        with self._cond:
+            while self._completed and now - self._completed[0] > THROUGHPUT_WINDOW:
+                self._completed.popleft()
+            waits = list(self._waits)
+            latencies = list(self._latencies)
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._urgent) + sum(len(q) for q in self._queues.values()),
+                "queue_by_session": {s: len(q) for s, q in self._queues.items()},
+                "admitted": self.admitted,
+                "decreases": self.decreases,
+                "wait_p50_s": round(float(np.percentile(waits, 50)), 3) if waits else 0.0,
+                "wait_p95_s": round(float(np.percentile(waits, 95)), 3) if waits else 0.0,
+                "latency_p50_s": round(float(np.percentile(latencies, 50)), 3) if latencies else 0.0,
+                "calls_per_min": round(len(self._completed) * 60.0 / THROUGHPUT_WINDOW, 1),
+                "baseline_s_per_token": round(self.baseline, 4) if self.baseline else None,
+            }
+
+
+_shared_controller = None
+_shared_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    # Один контроллер на процесс: все сессии Streamlit живут в одном процессе
+    global _shared_controller
+    with _shared_lock:
+        if _shared_controller is None:
+            _shared_controller = AdmissionController()
+        return _shared_controller
@@ -0,0 +1,376 @@
+# llm_client.py
+import json
+import random
+import socket
+import threading
+import time
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm_admission import ADMISSION_MAX, CANCEL_POLL, LLMCancelled, current_llm_cancel, get_admission_controller
+from llm_response_cache import get_response_cache, response_key
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+LLM_CONCURRENCY = 4          # сколько вызовов одновременно — под это считается пул соединений
+CONNECT_TIMEOUT = 5          # сек. на установку соединения
+READ_TIMEOUT = 300           # сек. ожидания данных (для стрима — между чанками)
+MAX_RETRIES = 2              # повторы только для временных ошибок
+BACKOFF_BASE = 0.5           # сек., растёт как 2^попытка, с джиттером
+RETRY_STATUS = {429, 500, 502, 503, 504}
+KEEP_ALIVE = "30m"            # модель и KV-кэш общего префикса остаются в памяти между вызовами
+RESPONSE_CACHE_ENABLED = True  # повторный одинаковый map/reduce-промпт (use_cache=True) отдаётся из index/llm_responses.sqlite
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _abort_on_cancel(cancel, response, finished):
+    # Отмена, пока стрим ждёт чанк (prefill, медленная генерация): shutdown сокета прерывает
+    # блокирующее чтение, close() из другого потока этого не делает
+    while not finished.wait(CANCEL_POLL):
+        if cancel.is_set():
+            sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return
+
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    # Длина хвоста text, который может оказаться началом тега (тег разрезан между чанками)
+    for k in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+
+# Потоковое удаление <think>...</think>: теги могут приходить по частям в разных чанках
+class ThinkStripper:
+    def __init__(self):
+        self.buffer = ""
+        self.inside = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        out = []
+        while self.buffer:
+            if self.inside:
+                end = self.buffer.find(THINK_CLOSE)
+                if end == -1:
+                    keep = _partial_tag_len(self.buffer, THINK_CLOSE)
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                self.buffer = self.buffer[end + len(THINK_CLOSE):]
+                self.inside = False
+            else:
+                start = self.buffer.find(THINK_OPEN)
+                if start == -1:
+                    keep = _partial_tag_len(self.buffer, THINK_OPEN)
+                    out.append(self.buffer[:len(self.buffer) - keep])
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                out.append(self.buffer[:start])
+                self.buffer = self.buffer[start + len(THINK_OPEN):]
+                self.inside = True
+        return "".join(out)
+
+    def flush(self) -> str:
+        rest, self.buffer = ("" if self.inside else self.buffer), ""
+        return rest
+
+
+# Метрики задержки вызовов по моделям
+class LLMMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._prompt_eval = {}
+
+    def record_prompt_eval(self, model_name: str, tokens: int, seconds: float):
+        with self._lock:
+            m = self._prompt_eval.setdefault(model_name, {"tokens": [], "seconds": []})
+            m["tokens"].append(tokens)
+            m["seconds"].append(seconds)
+
+    def record(self, model_name: str, seconds: float, ok: bool, retries: int):
+        with self._lock:
+            m = self._calls.setdefault(model_name, {"latencies": [], "errors": 0, "retries": 0})
+            m["latencies"].append(seconds)
+            m["errors"] += 0 if ok else 1
+            m["retries"] += retries
+
+    def summary(self) -> dict:
+        with self._lock:
+            result = {}
+            for model_name, m in self._calls.items():
+                lat = m["latencies"]
+                result[model_name] = {
+                    "calls": len(lat),
+                    "errors": m["errors"],
+                    "retries": m["retries"],
+                    "p50_s": round(float(np.percentile(lat, 50)), 3),
+                    "p95_s": round(float(np.percentile(lat, 95)), 3),
+                    "mean_s": round(float(np.mean(lat)), 3),
+                }
+            for model_name, m in self._prompt_eval.items():
+                result.setdefault(model_name, {}).update({
+                    "prompt_eval_calls": len(m["seconds"]),
+                    "prompt_eval_tokens": int(np.sum(m["tokens"])),
+                    "prompt_eval_p50_s": round(float(np.percentile(m["seconds"], 50)), 3),
+                    "prompt_eval_total_s": round(float(np.sum(m["seconds"])), 3),
+                })
+            return result
+
+
+def _eval_stats(result) -> tuple:
+    # (eval_count, eval_duration в сек.) финального ответа Ollama — сигнал для контроллера допуска
+    if not result:
+        return None, None
+    duration = result.get("eval_duration")
+    return result.get("eval_count"), duration / 1e9 if duration else None
+
+
+class TransientLLMError(Exception):
+    pass
+
+
+# Общий HTTP-клиент Ollama: пул keep-alive соединений, таймауты, повторы с джиттером
+class OllamaClient:
+    def __init__(
+        self,
+        url: str = OLLAMA_URL,
+        pool_size: int = LLM_CONCURRENCY,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        cache=None,
+        admission=None,
+    ):
+        self.url = url
+        self.cache = cache
+        self.admission = admission
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.metrics = LLMMetrics()
+        self.session = requests.Session()
+        # pool_block — лишние запросы ждут свободное соединение, а не открывают новые
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, payload: dict, stream: bool):
+        response = self.session.post(self.url, json=payload, stream=stream, timeout=self.timeout)
+        if response.status_code in RETRY_STATUS:
+            response.close()
+            raise TransientLLMError(f"HTTP {response.status_code}")
+        response.raise_for_status()
+        return response
+
+    def _report_prompt_eval(self, model_name: str, chunk: dict):
+        # Ollama отдаёт длительности в наносекундах; маленький prompt_eval_count при длинном
+        # промпте — признак того, что префикс взят из KV-кэша
+        if "prompt_eval_duration" not in chunk and "prompt_eval_count" not in chunk:
+            return
+        tokens = int(chunk.get("prompt_eval_count", 0))
+        seconds = chunk.get("prompt_eval_duration", 0) / 1e9
+        self.metrics.record_prompt_eval(model_name, tokens, seconds)
+        print(f"🧮 {model_name}: prompt eval {tokens} ток. за {seconds:.2f} с")
+
+    def _with_retries(self, model_name: str, call):
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                result = call()
+                self.metrics.record(model_name, time.perf_counter() - started, True, attempt)
+                return result
+            except (requests.ConnectionError, requests.Timeout, TransientLLMError) as e:
+                if attempt >= self.max_retries:
+                    self.metrics.record(model_name, time.perf_counter() - started, False, attempt)
+                    raise
+                delay = BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.5)
+                attempt += 1
+                print(f"🔁 {model_name}: {e} — повтор {attempt}/{self.max_retries} через {delay:.1f} с")
+                time.sleep(delay)
+            except LLMCancelled:
+                raise
+            except Exception:
+                self.metrics.record(model_name, time.perf_counter() - started, False, attempt)
+                raise
+
+    def generate(self, prompt: str, model_name: str, options: dict = None, keep_alive=None,
+                 use_cache: bool = False) -> dict:
+        # Возвращает JSON ответа Ollama целиком: текст в "response", метрики рядом.
+        # use_cache — только для вызовов, чей ответ можно переиспользовать (map/reduce);
+        # вызовы с проверкой и повтором (чеклист) кэш не используют
+        payload = {"model": model_name, "prompt": prompt, "stream": False,
+                   "keep_alive": KEEP_ALIVE if keep_alive is None else keep_alive}
+        if options:
+            payload["options"] = options
+
+        key = response_key(model_name, prompt, options) if self.cache and use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                print(f"💾 {model_name}: ответ из кэша")
+                return {"model": model_name, "response": cached, "done": True, "cached": True}
+
+        cancel = current_llm_cancel()
+        if cancel is not None:
+            # Отменяемый вызов идёт стримом: при отмене соединение закрывается между чанками
+            # и Ollama прекращает генерацию, освобождая слот
+            parts, final = [], {}
+            for chunk in self.stream(prompt, model_name, options, keep_alive, use_cache):
+                parts.append(chunk.get("response", ""))
+                final = chunk
+            return {**final, "response": "".join(parts)}
+
+        def call():
+            with self._post(payload, stream=False) as response:
+                return response.json()
+
+        if self.admission:
+            self.admission.acquire()
+        started, result = time.perf_counter(), None
+        try:
+            result = self._with_retries(model_name, call)
+        finally:
+            if self.admission:
+                self.admission.release(time.perf_counter() - started, result is not None,
+                                       *_eval_stats(result))
+        self._report_prompt_eval(model_name, result)
+        if key and result.get("done", True) and "error" not in result:
+            self.cache.put(key, model_name, result.get("response", ""))
+        return result
+
+    def stream(self, prompt: str, model_name: str, options: dict = None, keep_alive=None, use_cache: bool = False):
+        # Повторяется только установка соединения; обрыв посреди стрима — ошибка
+        payload = {"model": model_name, "prompt": prompt, "stream": True,
+                   "keep_alive": KEEP_ALIVE if keep_alive is None else keep_alive}
+        if options:
+            payload["options"] = options
+        key = response_key(model_name, prompt, options) if self.cache and use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                print(f"💾 {model_name}: ответ из кэша")
+                yield {"model": model_name, "response": cached, "done": True, "cached": True}
+                return
+
+        # Слот допуска держится до конца стрима (или до закрытия генератора)
+        cancel = current_llm_cancel()
+
+        def check_cancel():
+            if cancel is not None and cancel.is_set():
+                raise LLMCancelled(f"{model_name}: вызов отменён")
+
+        check_cancel()
+        if self.admission:
+            self.admission.acquire(cancel=cancel)
+        started, final, cancelled = time.perf_counter(), None, False
+
+        def post():
+            check_cancel()
+            return self._post(payload, stream=True)
+
+        finished = threading.Event()
+        try:
+            response = self._with_retries(model_name, post)
+            if cancel is not None:
+                threading.Thread(target=_abort_on_cancel, args=(cancel, response, finished), daemon=True).start()
+            raw = []
+            with response:
+                try:
+                    for chunk in iter_ollama_stream(response):
+                        check_cancel()
+                        raw.append(chunk.get("response", ""))
+                        if chunk.get("done"):
+                            final = chunk
+                            self._report_prompt_eval(model_name, chunk)
+                        if key and chunk.get("done"):
+                            # В кэш попадает только полностью полученный ответ
+                            self.cache.put(key, model_name, "".join(raw))
+                        yield chunk
+                except (requests.RequestException, OSError):
+                    # Соединение закрыто по отмене — это отмена, а не ошибка бэкенда
+                    check_cancel()
+                    raise
+                if final is None:
+                    check_cancel()
+        except LLMCancelled:
+            cancelled = True
+            raise
+        finally:
+            finished.set()
+            # Отмена — не признак перегрузки бэкенда: лимит от неё не снижается
+            if self.admission:
+                self.admission.release(time.perf_counter() - started, final is not None or cancelled,
+                                       *_eval_stats(final))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    # Один клиент (и пул соединений) на процесс для всех вызовов LLM
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Пул соединений — под максимальный глобальный лимит, сам лимит задаёт контроллер допуска
+            _client = OllamaClient(pool_size=ADMISSION_MAX,
+                                   cache=get_response_cache() if RESPONSE_CACHE_ENABLED else None,
+                                   admission=get_admission_controller())
+        return _client
+
+
+def iter_ollama_stream(response):
+    # Ollama отдаёт NDJSON: по одному JSON-объекту на строку
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise RuntimeError(chunk["error"])
+        yield chunk
+        if chunk.get("done"):
+            break
+
+
+def stream_generate(prompt: str, model_name: str, on_token=None, on_stats=None, options: dict = None,
+                    use_cache: bool = False) -> str:
+    # on_token(delta) получает видимый текст по мере генерации (без <think>)
+    started = time.perf_counter()
+    stats = {"model": model_name, "ttft_s": None, "total_s": None, "chunks": 0}
+    stripper = ThinkStripper()
+    parts = []
+
+    try:
+        for chunk in get_client().stream(prompt, model_name, options, use_cache=use_cache):
+            stats["chunks"] += 1
+            visible = stripper.feed(chunk.get("response", ""))
+            if chunk.get("done"):
+                visible += stripper.flush()
+            if not visible:
+                continue
+            if stats["ttft_s"] is None:
+                stats["ttft_s"] = time.perf_counter() - started
+            parts.append(visible)
+            if on_token:
+                on_token(visible)
+    except LLMCancelled:
+        # Оборванный по отмене ответ: уже показанный текст остаётся ответом
+        if not parts:
+            raise
+        stats["cancelled"] = True
+        print(f"⏰ {model_name}: стрим оборван по отмене")
+
+    stats["total_s"] = time.perf_counter() - started
+    ttft = f"{stats['ttft_s']:.2f} с" if stats["ttft_s"] is not None else "—"
+    print(f"⏱️ {model_name}: первый токен через {ttft}, всего {stats['total_s']:.2f} с")
+    if on_stats:
+        on_stats(stats)
+    return "".join(parts).strip()
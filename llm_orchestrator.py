@@ -0,0 +1,254 @@
+# llm_orchestrator.py
+import asyncio
+import contextvars
+import functools
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from llm_admission import reset_llm_cancel, reset_llm_priority, set_llm_cancel, set_llm_priority
+from llm_client import LLM_CONCURRENCY
+
+MAP_TIMEOUT = 240            # сек. на один map-вызов
+MAP_DEADLINE = 90            # сек. на map-этап вопроса: после него reduce идёт по уже готовым ответам
+ANSWER_BUDGET = 150          # сек. на весь вопрос: по его истечении стрим финального ответа обрывается
+REDUCE_FANIN = 3             # сколько частичных ответов объединяет один промежуточный reduce
+REDUCE_PROMPT_BUDGET = 4096  # токенов частичных ответов в одном reduce-промпте
+
+
+@dataclass
+class MapTask:
+    index: int
+    kind: str                      # "text" | "table"
+    prompt: str
+    model_name: str
+    norms: list = field(default_factory=list)
+    # Установлен — вызов не ждёт слот, не отправляется, а начатый стрим обрывается
+    cancel: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
+
+
+@dataclass
+class MapResult:
+    index: int
+    kind: str
+    ok: bool
+    text: str = ""
+    error: str = ""
+    elapsed_s: float = 0.0
+    norms: list = field(default_factory=list)
+    late: bool = False             # не дождались к дедлайну — нормы батча не вошли в ответ
+
+
+# Вызовы идут в своём пуле, а не в executor цикла: asyncio.run при выходе ждёт свой
+# executor, и отменённый вызов, ещё не заметивший отмену, задержал бы ответ
+_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-map")
+
+
+def _in_thread(fn, *args, cancel=None):
+    # Как asyncio.to_thread: контекст (сессия LLM) копируется в поток;
+    # cancel — threading.Event, по которому клиент LLM прекращает вызов
+    ctx = contextvars.copy_context()
+    if cancel is not None:
+        ctx.run(set_llm_cancel, cancel)
+    return asyncio.get_running_loop().run_in_executor(_EXECUTOR, functools.partial(ctx.run, fn, *args))
+
+
+def is_error_response(text: str) -> bool:
+    # call_llm не бросает исключения, а возвращает строку с "❌"
+    return not text or text.lstrip().startswith("❌")
+
+
+async def _run_map(task: MapTask, call_fn, timeout: float) -> MapResult:
+    started = time.perf_counter()
+    try:
+        text = await asyncio.wait_for(_in_thread(call_fn, task.prompt, task.model_name, cancel=task.cancel), timeout)
+        ok = not is_error_response(text)
+        return MapResult(task.index, task.kind, ok, text if ok else "", "" if ok else text,
+                         time.perf_counter() - started, task.norms)
+    except asyncio.TimeoutError:
+        task.cancel.set()
+        return MapResult(task.index, task.kind, False, error=f"таймаут {timeout} с",
+                         elapsed_s=time.perf_counter() - started, norms=task.norms)
+    except Exception as e:
+        return MapResult(task.index, task.kind, False, error=str(e),
+                         elapsed_s=time.perf_counter() - started, norms=task.norms)
+
+
+async def _run_merge(texts: list, merge_fn, timeout: float, cancel):
+    try:
+        text = await asyncio.wait_for(_in_thread(merge_fn, texts, cancel=cancel), timeout)
+        return None if is_error_response(text) else text
+    except Exception as e:
+        print(f"❌ Промежуточное объединение не удалось: {e}")
+        return None
+
+
+def _take_merge_group(partials: list, fanin: int, count_fn, budget: int) -> list:
+    # До fanin самых ранних частичных ответов, суммарно не больше budget токенов;
+    # минимум два, иначе объединять нечего
+    group, tokens = [], 0
+    for text in partials:
+        size = count_fn(text) if count_fn else 0
+        if len(group) >= 2 and (len(group) >= fanin or tokens + size > budget):
+            break
+        group.append(text)
+        tokens += size
+    del partials[:len(group)]
+    return group
+
+
+async def _run_producer(producer) -> list:
+    # Ошибка поиска не глушится: цикл записывает её в results как неудачу этого вида норм
+    return list(await _in_thread(producer))
+
+
+async def run_map_reduce_async(tasks: list, call_fn, reduce_fn, concurrency=LLM_CONCURRENCY,
+                               timeout=MAP_TIMEOUT, on_result=None, merge_fn=None, count_fn=None,
+                               merge_budget=REDUCE_PROMPT_BUDGET, fanin=REDUCE_FANIN, producers=None,
+                               deadline=None, budget=None):
+    # Все map-вызовы (текстовые и табличные) — на одном цикле событий с общим лимитом.
+    # producers — {вид: функция без аргументов} (поиск + сборка промптов), возвращающая MapTask;
+    # они работают параллельно в потоках, и их задачи встают в очередь сразу по готовности,
+    # не дожидаясь остальных. Номера задач назначаются в порядке поступления.
+    # Если задан merge_fn, готовые ответы объединяются по fanin штук, пока остальные
+    # map-вызовы ещё идут; промежуточные объединения получают свободный слот первыми.
+    # reduce_fn(partials, results) получает оставшиеся (не больше fanin) частичные ответы.
+    # deadline — сек. от начала на map-этап: после него незавершённые вызовы отменяются,
+    # reduce идёт по готовым ответам вне очереди, а пропущенные батчи (и незавершённый
+    # поиск) попадают в results с late=True. Упавший поиск — MapResult(0, вид, ok=False).
+    # budget — сек. от начала на весь вопрос: map-этап не дольше него, а reduce получает
+    # остаток и обрывается по нему (в results — MapResult(0, "reduce", late=True)).
+    queue, numbering = [], itertools.count(1)
+    partials, merge_queue = [], []
+    running = {}     # future -> MapTask | группа для объединения; занимают слоты LLM
+    producing = {asyncio.ensure_future(_run_producer(p)): kind for kind, p in (producers or {}).items()}
+    merge_cancel = threading.Event()
+    results = []
+    total = 0
+    started = time.perf_counter()
+    limits = [t for t in (deadline, budget) if t is not None]
+    map_deadline = min(limits) if limits else None
+
+    def enqueue(new_tasks):
+        nonlocal total
+        for task in new_tasks:
+            task.index = next(numbering)
+            queue.append(task)
+        total += len(new_tasks)
+
+    def need_merge():
+        if len(partials) < 2:
+            return False
+        merges = len(merge_queue) + sum(1 for item in running.values() if not isinstance(item, MapTask))
+        if producing or queue or merges or any(isinstance(item, MapTask) for item in running.values()):
+            # Пока идут map-вызовы — объединяем только полные группы
+            return len(partials) >= fanin
+        # Всё готово: сводим к fanin ответам, укладывающимся в бюджет финального reduce
+        tokens = sum(count_fn(t) for t in partials) if count_fn else 0
+        return len(partials) > fanin or tokens > merge_budget
+
+    def schedule():
+        while merge_fn and need_merge():
+            merge_queue.append(_take_merge_group(partials, fanin, count_fn, merge_budget))
+        while len(running) < concurrency and (merge_queue or queue):
+            if merge_queue:
+                group = merge_queue.pop(0)
+                running[asyncio.ensure_future(_run_merge(group, merge_fn, timeout, merge_cancel))] = group
+            else:
+                task = queue.pop(0)
+                running[asyncio.ensure_future(_run_map(task, call_fn, timeout))] = task
+
+    enqueue(list(tasks))
+    schedule()
+    while running or producing:
+        remaining = None if map_deadline is None else map_deadline - (time.perf_counter() - started)
+        if remaining is not None and remaining <= 0:
+            break
+        done, _ = await asyncio.wait(set(running) | set(producing), timeout=remaining,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            if future in producing:
+                kind = producing.pop(future)
+                try:
+                    enqueue(future.result())
+                except Exception as e:
+                    # Поиск норм этого вида упал — ответ будет без них, как и при дедлайне
+                    print(f"❌ Поиск норм ({kind}) не удался: {e}")
+                    results.append(MapResult(0, kind, False, error=f"поиск норм не удался: {e}",
+                                             elapsed_s=time.perf_counter() - started))
+                continue
+            item = running.pop(future)
+            if isinstance(item, MapTask):
+                result = future.result()
+                results.append(result)
+                status = "✅" if result.ok else "❌"
+                print(f"{status} {result.kind} батч {result.index}: {result.elapsed_s:.1f} с {result.error}")
+                if result.ok:
+                    partials.append(result.text)
+                if on_result:
+                    on_result(result, len(results), total)
+            else:
+                merged = future.result()
+                # Неудачное объединение не теряет ответы — они уходят в reduce как есть
+                partials.extend([merged] if merged is not None else item)
+                if merged is None:
+                    merge_fn = None
+                else:
+                    print(f"🔗 Объединено {len(item)} ответа(ов)")
+        schedule()
+
+    if running or producing or queue:
+        elapsed = time.perf_counter() - started
+        print(f"⏰ Дедлайн {map_deadline} с: reduce по {len(partials)} готовым ответам")
+        merge_cancel.set()
+        for future, kind in producing.items():
+            # Поиск норм этого вида не закончился — в ответ не вошёл ни один его батч
+            future.cancel()
+            print(f"⏰ Поиск норм ({kind}) не завершился к дедлайну")
+            results.append(MapResult(0, kind, False, error="поиск норм не завершился к дедлайну",
+                                     elapsed_s=elapsed, late=True))
+        late = [(task, "не запущен до дедлайна") for task in queue]
+        for future, item in running.items():
+            future.cancel()
+            if isinstance(item, MapTask):
+                late.append((item, "не успел к дедлайну"))
+            else:
+                # Объединение не успело — его ответы идут в reduce как есть
+                partials.extend(item)
+        for task, reason in late:
+            task.cancel.set()
+            results.append(MapResult(task.index, task.kind, False, error=reason, elapsed_s=elapsed,
+                                     norms=task.norms, late=True))
+
+    results.sort(key=lambda r: r.index)
+    # reduce — в потоке цикла (потоке Streamlit), чтобы он мог стримить ответ в UI;
+    # к этому моменту все map-задачи завершены или отменены по дедлайну.
+    # reduce получает слот LLM раньше вызовов в очередях сессий и остаток бюджета:
+    # по его истечении таймер отменяет вызов — стрим обрывается, показанный текст остаётся
+    reduce_cancel, timer = threading.Event(), None
+    if budget is not None:
+        timer = threading.Timer(max(0.0, budget - (time.perf_counter() - started)), reduce_cancel.set)
+        timer.daemon = True
+        timer.start()
+    token, cancel_token = set_llm_priority(True), set_llm_cancel(reduce_cancel)
+    try:
+        answer = reduce_fn(partials, results)
+    finally:
+        reset_llm_cancel(cancel_token)
+        reset_llm_priority(token)
+        if timer:
+            timer.cancel()
+    if reduce_cancel.is_set():
+        print(f"⏰ Бюджет {budget} с исчерпан: финальный ответ оборван")
+        results.append(MapResult(0, "reduce", False, error=f"финальный ответ оборван: бюджет {budget} с исчерпан",
+                                 elapsed_s=time.perf_counter() - started, late=True))
+    return answer, results
+
+
+def run_map_reduce(tasks: list, call_fn, reduce_fn, concurrency=LLM_CONCURRENCY, timeout=MAP_TIMEOUT,
+                   on_result=None, merge_fn=None, count_fn=None, merge_budget=REDUCE_PROMPT_BUDGET,
+                   fanin=REDUCE_FANIN, producers=None, deadline=None, budget=None):
+    return asyncio.run(run_map_reduce_async(tasks, call_fn, reduce_fn, concurrency, timeout, on_result,
+                                            merge_fn, count_fn, merge_budget, fanin, producers, deadline, budget))
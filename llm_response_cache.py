@@ -0,0 +1,116 @@
+# llm_response_cache.py
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+RESPONSE_CACHE_PATH = BASE_DIR / "index" / "llm_responses.sqlite"
+RESPONSE_CACHE_MAX_ITEMS = 5000            # LRU-лимит по числу ответов
+RESPONSE_CACHE_TTL = 7 * 24 * 3600         # сек.; старше — считается устаревшим
+
+
+def prompt_sha(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def response_key(model_name: str, prompt: str, options: dict = None) -> str:
+    # Ключ — модель + опции генерации + SHA промпта; keep_alive и stream на ответ не влияют
+    raw = json.dumps([model_name, options or {}, prompt_sha(prompt)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Дисковый кэш ответов LLM: одинаковый промпт (тот же вопрос + те же нормы) не идёт в модель повторно
+class LLMResponseCache:
+    def __init__(self, db_path: Path = RESPONSE_CACHE_PATH, max_items: int = RESPONSE_CACHE_MAX_ITEMS,
+                 ttl: float = RESPONSE_CACHE_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.index_version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, index_version TEXT,"
+            " response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    def set_index_version(self, index_version: str):
+        # Новая версия индекса норм — ответы, построенные на старой, удаляются
+        with self._lock:
+            if index_version == self.index_version:
+                return
+            self.index_version = index_version
+            removed = self._db.execute(
+                "DELETE FROM responses WHERE index_version IS NOT ?", (index_version,)
+            ).rowcount
+            self._db.commit()
+        if removed:
+            print(f"🧹 Кэш ответов LLM: удалено {removed} записей старой версии индекса")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ? AND index_version IS ?",
+                (key, self.index_version),
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model_name: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, index_version, response, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, self.index_version, response, now, now),
+            )
+            # LRU: сверх лимита удаляем давно не запрашивавшиеся ответы
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_items,),
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            items = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "items": items,
+                "index_version": self.index_version,
+            }
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache() -> LLMResponseCache:
+    # Один кэш на процесс — общий для map- и reduce-вызовов
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMResponseCache()
+        return _shared_cache
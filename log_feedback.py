@@ -1,10 +1,15 @@
 import json
 from pathlib import Path
 from datetime import datetime
+from answer_cache import get_answer_cache
 
 LOG_PATH = Path("feedback.jsonl")
 
 def log_feedback(question, answer, norm_ids, score: int):
+    # Ответ с 👎 больше не отдаётся из кэша похожим вопросам
+    if score <= 0 and question and answer:
+        get_answer_cache().evict(question, answer)
+
     if not question or not answer or not norm_ids:
         print("⚠️ Пропущена запись: пустые поля")
         return
@@ -3,8 +3,10 @@ import torch
 from sentence_transformers import SentenceTransformer
 import streamlit as st
 
+DEFAULT_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
 @st.cache_resource(show_spinner="🤖 Загружается модель...")  # безопасно кэшируем
-def load_sentence_transformer_model(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"):
+def load_sentence_transformer_model(model_name=DEFAULT_MODEL_NAME):
     # Сперва загружаем на CPU — это важно
     model = SentenceTransformer(model_name, trust_remote_code=False)
     
@@ -0,0 +1,32 @@
+# model_routing.py
+from llm_client import get_client
+
+# Модель на каждый этап конвейера
+MODEL_ROUTES = {
+    "map_text": "gpt-oss:20b",     # map по текстовым нормам
+    "map_table": "gpt-oss:20b",    # map по табличным нормам
+    "merge": "gpt-oss:20b",        # промежуточное объединение ответов
+    "reduce": "gpt-oss:20b",       # финальный ответ
+    "checklist": "mistral",        # генерация чеклиста из норм
+}
+# Модель поменьше, если очередь к LLM глубокая; этапов без записи это не касается
+FALLBACK_ROUTES = {
+    "map_text": "mistral",
+    "map_table": "mistral",
+    "merge": "mistral",
+}
+FALLBACK_QUEUE_DEPTH = 6           # ожидающих вызовов в контроллере допуска; None — без подмены
+
+
+def route_model(stage: str, allow_fallback=True) -> str:
+    if stage not in MODEL_ROUTES:
+        raise ValueError(f"Неизвестный этап: {stage} (доступны: {', '.join(MODEL_ROUTES)})")
+    model_name = MODEL_ROUTES[stage]
+    fallback = FALLBACK_ROUTES.get(stage)
+    if allow_fallback and fallback and FALLBACK_QUEUE_DEPTH is not None:
+        admission = get_client().admission   # контроллер того клиента, через который идут вызовы
+        depth = admission.queue_depth() if admission else 0
+        if depth >= FALLBACK_QUEUE_DEPTH:
+            print(f"🔀 {stage}: очередь {depth} — {model_name} → {fallback}")
+            return fallback
+    return model_name
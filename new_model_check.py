@@ -1,9 +1,14 @@
-import requests
 import time
 import re
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from scripts.extrect_object_category import group_norms_by_category
+from llm_client import stream_generate, get_client, LLM_CONCURRENCY
+from llm_orchestrator import ANSWER_BUDGET, MAP_DEADLINE, MapTask, run_map_reduce
+from prompt_packer import context_options, count_tokens, pack_norm_batches
+from model_routing import route_model
+# "prefix" — инструкция и вопрос в начале: общий префикс всех map-промптов одного вопроса
+# Ollama не пересчитывает (KV-кэш слота); "legacy" — прежний порядок с инструкцией в конце
+PROMPT_LAYOUT = "prefix"
 
 def dedup_text_norms(norms):
     seen = set()
@@ -72,8 +77,15 @@ def generate_combined_prompt(text_norms, table_norms, user_question):
 
     return prompt
 
-def generate_categorized_prompt(text_norms, table_norms, user_question,sourse):
-    prompt_parts = [f"Вопрос архитектора:\n{user_question.strip()}"]
+def generate_categorized_prompt(text_norms, table_norms, user_question,sourse, layout=None):
+    layout = layout or PROMPT_LAYOUT
+    if layout == "prefix":
+        prompt_parts = [
+            f"На основе только нормативов ниже дай краткий, полезный и понятный ответ архитектору на русском языке.Документ который ты читаешь {sourse}.КРИТИЧНО ВАЖНО ИСПОЛЬЗУЙ ТОЛЬКО представленные нормы не бери данные со своей базы. Там указывается полный пункт к нормам используй их когда будешь писать ответ",
+            f"Вопрос архитектора:\n{user_question.strip()}",
+        ]
+    else:
+        prompt_parts = [f"Вопрос архитектора:\n{user_question.strip()}"]
 
     if text_norms:
         grouped_text = group_norms_by_category(text_norms)
@@ -87,7 +99,8 @@ def generate_categorized_prompt(text_norms, table_norms, user_question,sourse):
             formatted = "\n\n".join([format_table_norm(n) for n in norms])
             prompt_parts.append(f"📊 {category} (Табличные нормы):\n{formatted}")
 
-    prompt_parts.append(f"\nНа основе только этих нормативов, дай краткий, полезный и понятный ответ архитектору на русском языке.Документ который ты читаешь {sourse}.КРИТИЧНО ВАЖНО ИСПОЛЬЗУЙ ТОЛЬКО представленные нормы не бери данные со своей базы. Там указывается полный пункт к нормам используй их когда будешь писать ответ")
+    if layout != "prefix":
+        prompt_parts.append(f"\nНа основе только этих нормативов, дай краткий, полезный и понятный ответ архитектору на русском языке.Документ который ты читаешь {sourse}.КРИТИЧНО ВАЖНО ИСПОЛЬЗУЙ ТОЛЬКО представленные нормы не бери данные со своей базы. Там указывается полный пункт к нормам используй их когда будешь писать ответ")
     return "\n\n".join(prompt_parts)
 
 
@@ -118,7 +131,7 @@ def generate_categorized_prompt(text_norms, table_norms, user_question,sourse):
         return f"❌ Ошибка при финальном суммировании: {e}"
 """
 
-def summarize_llm_batches(responses, question, model_name="qwen3"):
+def summarize_llm_batches(responses, question, model_name="qwen3", on_token=None, on_stats=None):
     if not responses:
         return "❗ Нет промежуточных ответов для суммирования."
 
@@ -131,29 +144,57 @@ def summarize_llm_batches(responses, question, model_name="qwen3"):
         "**📌 Сформулируй итоговый ответ, чётко указав нормы по каждому типу объекта.**"
     )
 
+    return call_llm(prompt, model_name=model_name, on_token=on_token, on_stats=on_stats)
+
+def merge_llm_batches(responses, question, model_name="qwen3"):
+    # Промежуточный reduce: сжимает несколько ответов в один, не теряя пунктов норм
+    combined = "\n\n".join([f"Ответ {i+1}:\n{resp}" for i, resp in enumerate(responses)])
+    prompt = (
+        "Ты — помощник архитектора. Объедини несколько промежуточных ответов в один.\n"
+        "Сохрани все требования, числовые значения и ссылки на пункты норм, убери повторы. Ничего не добавляй от себя.\n\n"
+        f"Вопрос архитектора:\n{question.strip()}\n\n"
+        f"{combined}\n\n"
+        "**📌 Объединённый ответ:**"
+    )
     return call_llm(prompt, model_name=model_name)
 
-def call_llm(prompt, model_name="mistral"):
+def call_llm(prompt, model_name="mistral", on_token=None, on_stats=None):
     try:
-        response = requests.post("http://localhost:11434/api/generate", json={
-            "model": model_name,
-            "prompt": prompt,
-            "stream": False
-        })
-        response.raise_for_status()
-        return clean_llm_output(response.json().get("response", "❌ Пустой ответ от модели"))
+        if on_token or on_stats:
+            # Потоковый режим: токены уходят в UI сразу, <think> вырезается на лету
+            return stream_generate(prompt, model_name, on_token=on_token, on_stats=on_stats,
+                                   options=context_options(model_name), use_cache=True)
+        response = get_client().generate(prompt, model_name, options=context_options(model_name), use_cache=True)
+        return clean_llm_output(response.get("response", "❌ Пустой ответ от модели"))
     except Exception as e:
         return f"❌ Ошибка при вызове модели: {e}"
 
+def omitted_batches(results):
+    # Батчи, чьи нормы не вошли в ответ: ошибка вызова или дедлайн; "reduce" — оборванный финальный ответ
+    return [
+        {
+            "kind": r.kind,
+            "index": r.index,
+            "reason": r.error,
+            "norms": [n.get("full_id") or n.get("indicator", "—") for n in r.norms],
+        }
+        for r in results if not r.ok
+    ]
+
 def check_multi_norms_mistral_nemo_parallel4(
-    text_norms: list,
-    table_norms: list,
+    text_norms,
+    table_norms,
     fact_text: str,
     sourse: str,
     progress_bar=None,
-    progress_label=None
+    progress_label=None,
+    answer_placeholder=None,
+    deadline=MAP_DEADLINE,
+    report=None,
+    budget=ANSWER_BUDGET
 ):
-    model_name = "gpt-oss:20b"
+    # report — необязательный dict: в "omitted" записываются пропущенные батчи;
+    # deadline — сек. на map-этап, budget — на весь вопрос (по нему обрывается финальный ответ)
     print(fact_text)
     def update_progress(step, label):
         if progress_bar:
@@ -161,32 +202,66 @@ def check_multi_norms_mistral_nemo_parallel4(
         if progress_label:
             progress_label.text(f"{label} — {int(step * 100)}%")
 
-    text_norms = dedup_text_norms(text_norms)
-    table_norms = dedup_table_norms(table_norms)
-
-    # === Разделение на 2 части ===
-    text_batches = list(split_into_batches(text_norms, max(1, len(text_norms)//2)))
-    table_batches = list(split_into_batches(table_norms, max(1, len(table_norms)//2)))
-
-    all_prompts = []
-    for batch in text_batches:
-        all_prompts.append(generate_categorized_prompt(batch, [], fact_text,sourse))
-    for batch in table_batches:
-        all_prompts.append(generate_categorized_prompt([], batch, fact_text,sourse))
+    # === Нормы укладываются в минимум промптов, помещающихся в контекст модели ===
+    prefix = generate_categorized_prompt([], [], fact_text, sourse)
+
+    # text_norms / table_norms — списки норм или функции без аргументов, которые их ищут.
+    # Текстовый и табличный поиск идут параллельно, и map-вызовы одного вида стартуют,
+    # как только готовы его батчи, не дожидаясь второго поиска
+    # Модель этапа выбирается, когда готовы его батчи: при глубокой очереди — запасная
+    def text_tasks():
+        norms = dedup_text_norms(text_norms() if callable(text_norms) else text_norms)
+        model_name = route_model("map_text")
+        base_tokens = count_tokens(prefix, model_name)
+        batches = pack_norm_batches(norms, model_name, format_text_norm, base_tokens,
+                                    header=lambda c: f"📜 {c} (Текстовые нормы):")
+        return [MapTask(0, "text", generate_categorized_prompt(batch, [], fact_text,sourse), model_name, batch)
+                for batch in batches]
+
+    def table_tasks():
+        norms = dedup_table_norms(table_norms() if callable(table_norms) else table_norms)
+        model_name = route_model("map_table")
+        base_tokens = count_tokens(prefix, model_name)
+        batches = pack_norm_batches(norms, model_name, format_table_norm, base_tokens,
+                                    header=lambda c: f"📊 {c} (Табличные нормы):")
+        return [MapTask(0, "table", generate_categorized_prompt([], batch, fact_text,sourse), model_name, batch)
+                for batch in batches]
 
-    all_responses = []
     update_progress(0.0, "Начало обработки")
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(call_llm, prompt, model_name) for prompt in all_prompts]
-        for i, future in enumerate(as_completed(futures)):
-            try:
-                result = future.result()
-                all_responses.append(result)
-                update_progress((i+1)/5, f"Обработано {i+1} из 4 блоков")
-            except Exception as e:
-                all_responses.append(f"❌ Ошибка при вызове модели: {e}")
-
-    final_answer = summarize_llm_batches(all_responses, fact_text, model_name)
+    def on_result(result, done, total):
+        update_progress(done / (total + 1), f"Обработано {done} из {total} блоков")
+
+    # Финальный ответ показываем по мере генерации
+    streamed = []
+    def on_token(delta):
+        streamed.append(delta)
+        answer_placeholder.markdown("".join(streamed) + "▌")
+
+    def on_stats(stats):
+        if progress_label and stats["ttft_s"] is not None:
+            progress_label.text(f"✍️ Финальный ответ: первый токен через {stats['ttft_s']:.1f} с")
+
+    # Готовые ответы объединяются по мере поступления, финальный reduce получает не больше
+    # REDUCE_FANIN коротких частичных ответов
+    def merge(texts):
+        return merge_llm_batches(texts, fact_text, route_model("merge"))
+
+    def reduce(partials, results):
+        late = sum(1 for r in results if r.late)
+        if late and progress_label:
+            progress_label.text(f"⏰ Время на поиск ответа вышло: {late} блок(ов) норм пропущено")
+        return summarize_llm_batches(
+            partials, fact_text, route_model("reduce"),
+            on_token=on_token if answer_placeholder else None,
+            on_stats=on_stats if answer_placeholder else None,
+        )
+
+    final_answer, results = run_map_reduce([], call_llm, reduce, concurrency=LLM_CONCURRENCY, on_result=on_result,
+                                           merge_fn=merge, count_fn=lambda t: count_tokens(t, route_model("reduce", allow_fallback=False)),
+                                           producers={"text": text_tasks, "table": table_tasks}, deadline=deadline,
+                                           budget=budget)
+    if report is not None:
+        report["omitted"] = omitted_batches(results)
     update_progress(1.0, "Финальный ответ готов")
     return final_answer
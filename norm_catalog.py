@@ -0,0 +1,75 @@
+# norm_catalog.py
+import re
+
+from norm_store import fetch_column, fetch_rows
+
+NORM_REF_RE = re.compile(r'\b\d{1,2}(?:\.\d{1,2}){1,4}\b')
+
+
+def clause_id(full_id: str) -> str:
+    return full_id.rsplit(":", 1)[-1] if ":" in full_id else full_id
+
+
+# Справочник норм: строится один раз на версию индекса, все поиски — по хэш-таблицам
+class NormCatalog:
+    def __init__(self, norms):
+        self.norms = norms
+        full_ids = [f or "" for f in fetch_column(norms, "full_id")]
+        sources = [(s or "").strip() if isinstance(s, str) else "" for s in fetch_column(norms, "source")]
+        domains = fetch_column(norms, "domain")
+
+        self.by_full_id = {}
+        self.by_source_clause = {}
+        self.by_clause = {}
+        for row, (full_id, source) in enumerate(zip(full_ids, sources)):
+            clause = clause_id(full_id)
+            # setdefault — первая норма в порядке корпуса, как при линейном поиске
+            self.by_full_id.setdefault(full_id, row)
+            self.by_source_clause.setdefault((source, clause), row)
+            self.by_clause.setdefault(clause, row)
+
+        self.sources = sorted({s for s in sources if s})
+        # domain — строка "a, b" или список доменов
+        self.domains = sorted({
+            d.strip()
+            for value in domains
+            for part in ([value] if isinstance(value, str) else value if isinstance(value, list) else [])
+            if isinstance(part, str)
+            for d in part.split(",") if d.strip()
+        })
+
+    def get(self, row: int) -> dict:
+        return fetch_rows(self.norms, [row])[0]
+
+    def find(self, norm_id: str):
+        # ?norm_id= может быть полным full_id или номером пункта
+        norm_id = (norm_id or "").strip()
+        row = self.by_full_id.get(norm_id)
+        if row is None:
+            row = self.by_clause.get(clause_id(norm_id))
+        return None if row is None else self.get(row)
+
+    def find_in_sources(self, clause: str, sources) -> int:
+        rows = [self.by_source_clause.get((s.strip(), clause)) for s in sources if isinstance(s, str)]
+        rows = [r for r in rows if r is not None]
+        return min(rows) if rows else None
+
+    def linkify(self, text: str, current_sources) -> str:
+        # Ссылки на пункты ответа: поиск по словарю + одно чтение найденных норм
+        if not isinstance(current_sources, list):
+            current_sources = [current_sources]
+        matches = {m.group(0) for m in NORM_REF_RE.finditer(text)}
+        rows = {clause: self.find_in_sources(clause, current_sources) for clause in matches}
+        found = {clause: row for clause, row in rows.items() if row is not None}
+        norms = dict(zip(found, fetch_rows(self.norms, list(found.values()))))
+
+        def replace(match):
+            norm_id = match.group(0)
+            norm = norms.get(norm_id)
+            if not norm:
+                return norm_id  # если не нашли, возвращаем как есть
+            source = norm.get("source", "").strip()
+            tooltip = norm.get("text", "").replace('"', "'").replace("\n", " ")
+            return f'<a href="?norm_id={norm_id}" title="{tooltip}"><b>{source}:{norm_id}</b></a>'
+
+        return NORM_REF_RE.sub(replace, text)
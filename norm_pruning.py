@@ -0,0 +1,48 @@
+# norm_pruning.py
+import numpy as np
+
+PRUNE_MIN_SCORE = 0.35   # абсолютный порог косинусного сходства
+PRUNE_MAX_GAP = 0.12     # обрыв: разница соседних (по убыванию) оценок больше этого — дальше не берём
+PRUNE_MASS = 0.95        # доля суммарной «полезной» массы (сходство выше порога), которую сохраняем
+PRUNE_MIN_KEEP = 3       # столько лучших норм проходит всегда
+
+
+def prune_hits(hits: list, min_score=PRUNE_MIN_SCORE, max_gap=PRUNE_MAX_GAP, mass=PRUNE_MASS,
+               min_keep=PRUNE_MIN_KEEP, tokens_fn=None):
+    # hits — пары (норма, сходство) в порядке выдачи ретривера.
+    # Порог отсечения считается по отсортированным оценкам, а прошедшие нормы
+    # остаются в исходном (гибридном) порядке.
+    report = {"retrieved": len(hits), "kept": len(hits), "cutoff": None, "reason": None, "tokens_saved": 0}
+    if len(hits) <= min_keep:
+        return [norm for norm, _ in hits], report
+
+    # Сравнение с порогом — в той же float32, иначе норма ровно на пороге отсекается
+    hit_scores = np.array([score for _, score in hits], dtype="float32")
+    scores = np.sort(hit_scores)[::-1]
+    keep, reason = len(scores), None
+
+    above = int(np.sum(scores >= min_score))
+    if above < keep:
+        keep, reason = above, "порог"
+
+    gaps = scores[:-1] - scores[1:]
+    big = np.flatnonzero(gaps[:max(keep - 1, 0)] > max_gap)
+    if len(big):
+        keep, reason = int(big[0]) + 1, "разрыв"
+
+    excess = np.clip(scores[:keep] - min_score, 0, None)
+    if excess.sum() > 0:
+        enough = int(np.searchsorted(np.cumsum(excess) / excess.sum(), mass)) + 1
+        if enough < keep:
+            keep, reason = enough, "масса"
+
+    keep = max(keep, min_keep)
+    cutoff = scores[keep - 1]
+    kept, dropped = [], []
+    for (norm, _), score in zip(hits, hit_scores):
+        (kept if score >= cutoff and len(kept) < keep else dropped).append(norm)
+
+    report.update(kept=len(kept), cutoff=round(float(cutoff), 4), reason=reason)
+    if tokens_fn:
+        report["tokens_saved"] = sum(tokens_fn(norm) for norm in dropped)
+    return kept, report
@@ -1,8 +1,11 @@
-import faiss
 import json
 import numpy as np
 from pathlib import Path
-from model_loader import load_sentence_transformer_model
+from model_loader import load_sentence_transformer_model, DEFAULT_MODEL_NAME
+from embedding_cache import get_query_embedding_cache
+from ann_index import load_faiss_index, search_allowed, cosine_scores
+from norm_store import load_records, fetch_rows, files_version, store_path, DEFAULT_LOAD_MODE
+from lexical_index import load_or_build_bm25, reciprocal_rank_fusion
 from difflib import SequenceMatcher
 import torch
 
@@ -47,67 +50,273 @@ def similar(a: str, b: str) -> float:
     return SequenceMatcher(None, a, b).ratio()
 
 
+# === Словарь applies_to: эмбеддинги считаются один раз при сборке индекса ===
+APPLIES_TO_THRESHOLD = 0.6  # порог сходства типа помещения
+HYBRID_CANDIDATES_FACTOR = 2  # сколько кандидатов (× top_k) берём из каждого списка перед слиянием
+
+
+def applies_to_vocab_path(index_path: Path) -> Path:
+    return Path(index_path).with_suffix(".applies_to.npz")
+
+
+def norm_applies_to_terms(norm: dict) -> list:
+    applies = norm.get("applies_to", [])
+    if isinstance(applies, str):
+        applies = [applies]
+    if not isinstance(applies, list):
+        return []
+    return [normalize_room_type(a) for a in applies if isinstance(a, str) and a.strip()]
+
+
+def build_applies_to_vocab(norms: list, model) -> dict:
+    # Уникальные (нормализованные) типы помещений + CSR-связь норма → термины
+    vocab = {}
+    indptr = [0]
+    indices = []
+    for norm in norms:
+        term_ids = sorted({vocab.setdefault(t, len(vocab)) for t in norm_applies_to_terms(norm)})
+        indices.extend(term_ids)
+        indptr.append(len(indices))
+
+    terms = list(vocab)
+    if terms:
+        vectors = np.asarray(model.encode(terms), dtype="float32")
+    else:
+        vectors = np.zeros((0, model.get_sentence_embedding_dimension()), dtype="float32")
+
+    return {
+        "terms": np.array(terms, dtype=str),
+        "vectors": vectors,
+        "indptr": np.array(indptr, dtype="int64"),
+        "indices": np.array(indices, dtype="int64"),
+    }
+
+
+def save_applies_to_vocab(vocab: dict, path: Path, index_version: str = None):
+    np.savez(path, **vocab, index_version=np.array(index_version or "", dtype=str))
+    print(f"🏷️ Словарь applies_to сохранён: {path} ({len(vocab['terms'])} терминов)")
+
+
+def load_applies_to_vocab(path: Path) -> dict:
+    with np.load(path) as data:
+        vocab = {key: data[key] for key in ("terms", "vectors", "indptr", "indices")}
+        vocab["index_version"] = str(data["index_version"]) if "index_version" in data else ""
+    return vocab
+
+
+# === Фасетный индекс: domain/source → отсортированные id норм ===
+FACET_FIELDS = ("domain", "source")
+NO_FILTER_VALUES = {"- не выбрано -", "— все —"}
+
+
+def facets_path(index_path: Path) -> Path:
+    return Path(index_path).with_suffix(".facets.json")
+
+
+def split_facet_values(value) -> list:
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list):
+        return []
+    return [v.strip().lower() for v in value if isinstance(v, str) and v.strip()]
+
+
+def build_facet_index(norms: list) -> dict:
+    # "norms" — число норм: постинги указывают на строки именно такого индекса
+    facets = {field: {} for field in FACET_FIELDS}
+    facets["norms"] = len(norms)
+    for i, norm in enumerate(norms):
+        for field in FACET_FIELDS:
+            for value in set(split_facet_values(norm.get(field, ""))):
+                facets[field].setdefault(value, []).append(i)
+    return facets
+
+
+def save_facet_index(facets: dict, path: Path, index_version: str = None):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({**facets, "index_version": index_version}, f, ensure_ascii=False)
+    print(f"🗂️ Фасетный индекс сохранён: {path}")
+
+
+def load_facet_index(path: Path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def index_files_version(index_path: Path) -> str:
+    # Версия FAISS-индекса и записей норм при нём; производные файлы (фасеты, applies_to, BM25)
+    # сохраняют её и перестраиваются, если она изменилась
+    norms_path = Path(index_path).with_suffix(".json")
+    return files_version([norms_path, index_path, store_path(norms_path)])
+
+
+def norm_index_version(base_dir: Path, source_file="norms_checklist_merged.json") -> str:
+    # Та же версия, что NormRAG.index_version, — без загрузки индекса
+    return index_files_version(base_dir / "index" / (Path(source_file).stem + ".index"))
+
+
 class NormRAG:
-    def __init__(self, base_dir: Path, source_file="norms_checklist_merged.json"):
-        self.model = load_sentence_transformer_model()
+    def __init__(self, base_dir: Path, source_file="norms_checklist_merged.json", load_mode=DEFAULT_LOAD_MODE,
+                 hybrid=True):
+        self.model_name = DEFAULT_MODEL_NAME
+        self.model = load_sentence_transformer_model(self.model_name)
+        self.embedding_cache = get_query_embedding_cache()
         self.norms_path = base_dir / "index" / source_file
         self.index_path = base_dir / "index" / (Path(source_file).stem + ".index")
 
-        with open(self.norms_path, "r", encoding="utf-8") as f:
-            self.norms = json.load(f)
-
-        self.index = faiss.read_index(str(self.index_path))
-
-    def query(self, text: str, top_k=32, applies_to: str = None,domain: str = None,source: str = None):
-        if domain == "- Не выбрано -":
-            domain = None
-        query_vec = self.model.encode([text])
-        D, I = self.index.search(np.array(query_vec), top_k * 2)
-        candidates = [self.norms[int(i)] for i in I[0] if 0 <= i < len(self.norms)]
-
-        if source:
-            candidates = [
-                n for n in candidates
-                if any(
-                    d.strip().lower() in [dd.strip().lower() for dd in n.get("source", "").split(",")]
-                    for d in source
-                )
-            ]
+        self.load_mode = load_mode
+        self.index_version = norm_index_version(base_dir, source_file)
+        self.norms = load_records(self.norms_path, load_mode)
+        self.index = load_faiss_index(self.index_path, mmap=load_mode != "heap")
+        self._load_applies_to_vocab()
+        self._load_facets()
+        self.hybrid = hybrid
+        self.lexical = load_or_build_bm25(self.norms_path, self.norms, self.index_version) if hybrid else None
+
+    def _load_facets(self):
+        path = facets_path(self.index_path)
+        facets = load_facet_index(path) if path.exists() else None
+        # Постинги другой версии индекса могут указывать не на те строки или за его конец
+        if facets is None or facets.get("norms") != len(self.norms) or facets.get("index_version") != self.index_version:
+            print(f"⚠️ Фасетный индекс не найден или устарел, строим: {path}")
+            facets = build_facet_index(self.norms)
+            self._save_fallback(save_facet_index, facets, path)
+        self.facets = {
+            field: {value: np.array(ids, dtype="int64") for value, ids in facets.get(field, {}).items()}
+            for field in FACET_FIELDS
+        }
+
+    def _save_fallback(self, save, data, path: Path):
+        # Построенное на лету сохраняется: следующий запуск не пересчитывает его заново
+        try:
+            save(data, path, self.index_version)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить {path.name} ({e})")
+
+    def _facet_ids(self, field: str, values) -> np.ndarray:
+        # Объединение id норм, у которых есть хотя бы одно из значений
+        postings = [self.facets[field].get(v) for v in split_facet_values(values)]
+        postings = [p for p in postings if p is not None]
+        if not postings:
+            return np.array([], dtype="int64")
+        return np.unique(np.concatenate(postings))
+
+    def _load_applies_to_vocab(self):
+        vocab_path = applies_to_vocab_path(self.index_path)
+        vocab = load_applies_to_vocab(vocab_path) if vocab_path.exists() else None
+        if (vocab is None or len(vocab["indptr"]) != len(self.norms) + 1
+                or vocab["index_version"] != self.index_version):
+            print(f"⚠️ Словарь applies_to не найден или устарел, строим: {vocab_path}")
+            vocab = build_applies_to_vocab(self.norms, self.model)
+            self._save_fallback(save_applies_to_vocab, vocab, vocab_path)
+
+        self.applies_terms = vocab["terms"]
+        self.applies_vectors = vocab["vectors"]
+        # Номер нормы для каждой записи CSR — для max-reduce по нормам
+        self.applies_indices = vocab["indices"]
+        self.applies_rows = np.repeat(np.arange(len(self.norms)), np.diff(vocab["indptr"]))
+
+    def _encode_queries(self, texts: list) -> np.ndarray:
+        return self.embedding_cache.encode(self.model, texts, self.model_name)
+
+    def embed_questions(self, questions: list) -> np.ndarray:
+        # Те же (кэшированные) эмбеддинги, что и для поиска, — повторного кодирования нет
+        return self._encode_queries(list(questions))
+
+    def _applies_to_scores(self, rooms) -> dict:
+        # Лучшее сходство applies_to каждой нормы с каждым запрошенным типом помещения
+        # (-inf, если терминов нет); все типы кодируются одним вызовом модели
+        rooms = list(dict.fromkeys(rooms))
+        room_vecs = self._encode_queries([normalize_room_type(r) for r in rooms])
+        term_scores = self.applies_vectors @ room_vecs.T
+        scores = {}
+        for j, room in enumerate(rooms):
+            best = np.full(len(self.norms), -np.inf, dtype="float32")
+            np.maximum.at(best, self.applies_rows, term_scores[self.applies_indices, j])
+            scores[room] = best
+        return scores
+
+    def _allowed_ids(self, applies_to=None, domain=None, source=None, room_scores=None):
+        # None — без ограничений, иначе отсортированный массив допустимых id
+        allowed = None
+        for field, values in (("source", source), ("domain", domain)):
+            if isinstance(values, str):
+                values = [values]
+            values = [v for v in (values or []) if v and v.strip().lower() not in NO_FILTER_VALUES]
+            if not values:
+                continue
+            ids = self._facet_ids(field, values)
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+
         if applies_to:
-            applies_vec = self.model.encode([applies_to])[0]
-            scored = []
-            for norm in candidates:
-                applies = norm.get("applies_to", [])
-                if isinstance(applies, str):
-                    applies = [applies]
-                applies = [a for a in applies if isinstance(a, str)]
-                if not applies:
-                    continue
-
-                apply_vecs = self.model.encode([a.lower() for a in applies])
-                best_score = max(np.dot(vec, applies_vec) for vec in apply_vecs)
-                if best_score > 0.6:  # порог
-                    scored.append(norm)
-
-            if scored:
-                candidates = scored
-        if domain:
-            candidates = [
-                n for n in candidates
-                if any(
-                    d.strip().lower() in [dd.strip().lower() for dd in n.get("domain", "").split(",")]
-                    for d in domain
-                )
-            ]
-
-      
-        return candidates[:top_k]
-    
+            if room_scores is None:
+                room_scores = self._applies_to_scores([applies_to])
+            room_ids = np.flatnonzero(room_scores[applies_to] > APPLIES_TO_THRESHOLD)
+            if allowed is not None:
+                room_ids = np.intersect1d(allowed, room_ids, assume_unique=True)
+            # Если по типу помещения ничего не подошло — фильтр не применяем
+            if len(room_ids):
+                allowed = room_ids
+        return allowed
+
+    def _search(self, query_vec: np.ndarray, top_k: int, allowed=None):
+        # Поиск только среди разрешённых id — без перебора лишних кандидатов
+        return search_allowed(self.index, query_vec, top_k, allowed)
+
+    def query(self, text: str, top_k=32, applies_to: str = None,domain: str = None,source: str = None, hybrid=None,
+              with_scores=False):
+        filters = {"applies_to": applies_to, "domain": domain, "source": source}
+        return self.query_many([text], top_k=top_k, filters=filters, hybrid=hybrid, with_scores=with_scores)[0]
+
+    def query_many(self, questions: list, top_k=32, filters=None, hybrid=None, with_scores=False) -> list:
+        # filters — один словарь (applies_to/domain/source) на все вопросы или список по вопросу;
+        # with_scores — вместо норм пары (норма, косинусное сходство с вопросом)
+        if filters is None or isinstance(filters, dict):
+            filters = [filters or {}] * len(questions)
+        if len(filters) != len(questions):
+            raise ValueError("Число фильтров должно совпадать с числом вопросов")
+        if not questions:
+            return []
+        hybrid = self.hybrid if hybrid is None else hybrid
+        if hybrid and self.lexical is None:
+            self.lexical = load_or_build_bm25(self.norms_path, self.norms, self.index_version)
+        n_candidates = top_k * HYBRID_CANDIDATES_FACTOR if hybrid else top_k
+
+        query_vecs = self._encode_queries(list(questions))
+        rooms = [f.get("applies_to") for f in filters if f.get("applies_to")]
+        room_scores = self._applies_to_scores(rooms) if rooms else {}
+
+        # Вопросы с одинаковыми фильтрами ищутся одной матричной операцией
+        groups = {}
+        for qi, f in enumerate(filters):
+            key = json.dumps(f, ensure_ascii=False, sort_keys=True, default=str)
+            groups.setdefault(key, []).append(qi)
+
+        results = [None] * len(questions)
+        for qids in groups.values():
+            f = filters[qids[0]]
+            allowed = self._allowed_ids(
+                applies_to=f.get("applies_to"), domain=f.get("domain"), source=f.get("source"),
+                room_scores=room_scores,
+            )
+            D, I = self._search(query_vecs[qids], n_candidates, allowed)
+            for row, qi in enumerate(qids):
+                ids = [int(i) for i in I[row] if 0 <= i < len(self.norms)]
+                if hybrid:
+                    # Точные токены (номера пунктов, классы, единицы) + семантика → RRF
+                    _, lexical_ids = self.lexical.search(questions[qi], n_candidates, allowed)
+                    ids = reciprocal_rank_fusion([ids, lexical_ids], top_k)
+                results[qi] = fetch_rows(self.norms, ids)
+                if with_scores:
+                    scores = cosine_scores(self.index, query_vecs[qi], ids)
+                    results[qi] = list(zip(results[qi], scores.tolist()))
+        return results
+
     def _query_class_norms(self, question: str, top_k=12):
         if not self.class_index or not self.class_meta:
             return []
 
-        query_vec = self.model.encode([question])
+        query_vec = self._encode_queries([question])
         D, I = self.class_index.search(query_vec, top_k)
         results = []
         for i in I[0]:
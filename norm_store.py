@@ -0,0 +1,262 @@
+# norm_store.py
+import hashlib
+import json
+import mmap
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# "sqlite" — колоночное хранилище норм, "mmap" — плоский бинарный файл,
+# "heap" — JSON/pickle целиком в память. Если нужного файла нет — переходим к следующему
+DEFAULT_LOAD_MODE = "sqlite"
+LOAD_MODES = ("heap", "mmap", "sqlite")
+STORE_FILE = "norms.sqlite"
+STORE_COLUMNS = ("full_id", "source", "domain", "applies_to", "text", "requirement", "check", "indicator", "values")
+# Колонки, где встречаются не только строки (списки доменов и т.п.): хранятся как JSON,
+# чтобы column() отдавал те же типы, что и записи в режимах heap/mmap
+JSON_COLUMNS = ("source", "domain", "applies_to", "values")
+
+
+def files_version(paths) -> str:
+    # Версия индекса: меняется при любой пересборке файлов (размер + время изменения)
+    h = hashlib.sha1()
+    for p in sorted(str(Path(p).resolve()) for p in paths):
+        stat = Path(p).stat() if Path(p).exists() else None
+        h.update(f"{p}:{stat.st_size}:{stat.st_mtime_ns}".encode() if stat else f"{p}:-".encode())
+    return h.hexdigest()[:16]
+
+
+def source_signature(path: Path):
+    # Отметка исходного JSON/pkl, из которого собраны хранилище и плоские метаданные
+    path = Path(path).resolve()
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _is_fresh(saved, path: Path, built_at: Path) -> bool:
+    # saved — отметка, записанная при сборке; без неё (старый формат) сравниваем время изменения
+    if saved is None:
+        return not Path(path).exists() or Path(path).stat().st_mtime_ns <= Path(built_at).stat().st_mtime_ns
+    current = source_signature(saved["path"])
+    # Исходника нет — сверять не с чем, а больше данных взять неоткуда
+    return current is None or current == saved
+
+
+def flat_records_paths(path: Path):
+    path = Path(path)
+    return path.with_suffix(".records.bin"), path.with_suffix(".records.offsets.npy")
+
+
+def write_flat_records(records: list, path: Path, source: Path = None):
+    # Записи подряд в UTF-8 JSON + массив смещений: строку можно прочитать без разбора всего файла.
+    # Первая строка файла — заголовок с отметкой исходника (source, по умолчанию path)
+    data_path, offsets_path = flat_records_paths(path)
+    header = json.dumps({"source": source_signature(source or path)}, ensure_ascii=False).encode("utf-8") + b"\n"
+    offsets = [len(header)]
+    with open(data_path, "wb") as f:
+        f.write(header)
+        for record in records:
+            blob = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            f.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+    np.save(offsets_path, np.array(offsets, dtype="int64"))
+    print(f"🗃️ Плоские метаданные сохранены: {data_path} ({len(records)} записей)")
+
+
+# Список записей поверх mmap: страницы общие для всех процессов, разбирается только запрошенное
+class FlatRecords:
+    def __init__(self, path: Path):
+        data_path, offsets_path = flat_records_paths(path)
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(data_path, "rb")
+        size = int(self.offsets[-1])
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        # Файлы старого формата начинаются сразу с записей (offsets[0] == 0)
+        start = int(self.offsets[0])
+        self.header = json.loads(self._data[:start].decode("utf-8")) if start else {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self._data[start:end].decode("utf-8"))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def store_path(path: Path) -> Path:
+    # Одно хранилище на каталог: текстовые и табличные нормы — разные коллекции в нём
+    return Path(path).parent / STORE_FILE
+
+
+def _column_value(record: dict, column: str):
+    value = record.get(column)
+    if column in JSON_COLUMNS:
+        return None if value is None else json.dumps(value, ensure_ascii=False)
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _load_json_value(value: str):
+    # Хранилища, собранные до перевода source/domain в JSON, держат там обычные строки
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def write_norm_store(records: list, path: Path, source: Path = None):
+    # Коллекция = имя файла метаданных (norms_checklist_merged, class_norms_merged);
+    # row совпадает с id вектора в FAISS-индексе; source — исходник записей (по умолчанию path)
+    db_path, collection = store_path(path), Path(path).stem
+    quoted = ", ".join(f'"{c}"' for c in STORE_COLUMNS)
+    with sqlite3.connect(str(db_path)) as db:
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS norms ("
+            " collection TEXT NOT NULL, row INTEGER NOT NULL, "
+            + ", ".join(f'"{c}" TEXT' for c in STORE_COLUMNS)
+            + ", record TEXT NOT NULL, PRIMARY KEY (collection, row))"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS norms_full_id ON norms (collection, full_id)")
+        db.execute("CREATE TABLE IF NOT EXISTS sources (collection TEXT PRIMARY KEY, source TEXT)")
+        db.execute("DELETE FROM norms WHERE collection = ?", (collection,))
+        db.execute("INSERT OR REPLACE INTO sources (collection, source) VALUES (?, ?)",
+                   (collection, json.dumps(source_signature(source or path), ensure_ascii=False)))
+        db.executemany(
+            f"INSERT INTO norms (collection, row, {quoted}, record) VALUES (?, ?, "
+            + ", ".join("?" for _ in STORE_COLUMNS) + ", ?)",
+            [
+                (collection, i, *(_column_value(r, c) for c in STORE_COLUMNS), json.dumps(r, ensure_ascii=False))
+                for i, r in enumerate(records)
+            ],
+        )
+    print(f"🗄️ Хранилище норм обновлено: {db_path} [{collection}] ({len(records)} записей)")
+
+
+def has_norm_store(path: Path) -> bool:
+    db_path = store_path(path)
+    if not db_path.exists():
+        return False
+    with sqlite3.connect(str(db_path)) as db:
+        try:
+            row = db.execute("SELECT 1 FROM norms WHERE collection = ? LIMIT 1", (Path(path).stem,)).fetchone()
+        except sqlite3.OperationalError:
+            return False
+    return row is not None
+
+
+# Коллекция норм в SQLite: записи читаются только по запросу, колонки — без разбора записей
+class NormStore:
+    def __init__(self, path: Path):
+        self.collection = Path(path).stem
+        self._db = sqlite3.connect(f"file:{store_path(path)}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._len = self._query("SELECT COUNT(*) FROM norms WHERE collection = ?", (self.collection,))[0][0]
+
+    def source(self):
+        # Отметка исходника при сборке; None — хранилище старого формата
+        try:
+            row = self._query("SELECT source FROM sources WHERE collection = ?", (self.collection,))
+        except sqlite3.OperationalError:
+            return None
+        return json.loads(row[0][0]) if row and row[0][0] else None
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.get_many(range(*i.indices(len(self))))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.get_many([i])[0]
+
+    def __iter__(self):
+        rows = self._query("SELECT record FROM norms WHERE collection = ? ORDER BY row", (self.collection,))
+        for (record,) in rows:
+            yield json.loads(record)
+
+    def get_many(self, ids) -> list:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        records = {}
+        # Ограничение SQLite на число параметров — читаем пачками
+        unique = list(dict.fromkeys(ids))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            rows = self._query(
+                f"SELECT row, record FROM norms WHERE collection = ? AND row IN ({', '.join('?' for _ in chunk)})",
+                (self.collection, *chunk),
+            )
+            records.update((row, json.loads(record)) for row, record in rows)
+        return [records[i] for i in ids]
+
+    def column(self, name: str) -> list:
+        if name not in STORE_COLUMNS:
+            raise ValueError(f"Неизвестная колонка: {name}")
+        rows = self._query(f'SELECT "{name}" FROM norms WHERE collection = ? ORDER BY row', (self.collection,))
+        if name in JSON_COLUMNS:
+            return [None if v is None else _load_json_value(v) for (v,) in rows]
+        return [v for (v,) in rows]
+
+
+def fetch_rows(records, ids) -> list:
+    # Только строки из результата поиска — одним запросом, если хранилище это умеет
+    if hasattr(records, "get_many"):
+        return records.get_many(ids)
+    return [records[int(i)] for i in ids]
+
+
+def fetch_column(records, name: str) -> list:
+    if hasattr(records, "column"):
+        return records.column(name)
+    return [r.get(name) for r in records]
+
+
+def load_records(path: Path, mode: str = DEFAULT_LOAD_MODE):
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Неизвестный режим загрузки: {mode} (доступны: {', '.join(LOAD_MODES)})")
+    path = Path(path)
+    # Устаревшее хранилище (исходник изменён после сборки, например merge) не используем,
+    # если есть из чего загрузить записи
+    if mode == "sqlite" and has_norm_store(path):
+        store = NormStore(path)
+        if not path.exists() or _is_fresh(store.source(), path, store_path(path)):
+            return store
+        store._db.close()
+        print(f"⚠️ Хранилище норм {store_path(path).name} [{store.collection}] устарело: исходник изменён после сборки — пересоберите индекс")
+    if mode in ("sqlite", "mmap") and all(p.exists() for p in flat_records_paths(path)):
+        records = FlatRecords(path)
+        if not path.exists() or _is_fresh(records.header.get("source"), path, flat_records_paths(path)[0]):
+            return records
+        print(f"⚠️ Плоские метаданные {flat_records_paths(path)[0].name} устарели: исходник изменён после сборки — пересоберите индекс")
+    if mode != "heap":
+        print(f"⚠️ Нет актуального хранилища/плоских метаданных для {path.name}, загружаем целиком")
+
+    if path.suffix == ".pkl":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,111 @@
+# prompt_packer.py
+import math
+from functools import lru_cache
+
+from scripts.extrect_object_category import group_norms_by_category
+
+# Токенизаторы HF для моделей Ollama (семейство = имя модели до ":")
+MODEL_TOKENIZERS = {
+    "gpt-oss": "openai/gpt-oss-20b",
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.3",
+    "qwen3": "Qwen/Qwen3-8B",
+}
+# Контекст модели в токенах — передаётся в Ollama как num_ctx каждого вызова (context_options)
+MODEL_CONTEXT = {
+    "gpt-oss": 8192,
+    "mistral": 8192,
+    "qwen3": 8192,
+}
+DEFAULT_CONTEXT = 4096       # num_ctx Ollama по умолчанию
+RESPONSE_RESERVE = 2048      # токенов оставляем под ответ (и рассуждение) модели
+CHARS_PER_TOKEN = 2.5        # оценка для кириллицы, если токенизатор недоступен
+NORM_TOKEN_CACHE_SIZE = 50000
+# Скачивать токенизатор с HF Hub, если его нет в локальном кэше. Выключено: загрузка
+# посреди запроса пользователя задерживает ответ; скачайте заранее или включите явно
+TOKENIZER_DOWNLOAD = False
+
+
+def model_family(model_name: str) -> str:
+    return model_name.split(":", 1)[0].lower()
+
+
+def model_context(model_name: str) -> int:
+    return MODEL_CONTEXT.get(model_family(model_name), DEFAULT_CONTEXT)
+
+
+def prompt_budget(model_name: str) -> int:
+    return model_context(model_name) - RESPONSE_RESERVE
+
+
+def context_options(model_name: str) -> dict:
+    # Без num_ctx Ollama берёт контекст модели по умолчанию и обрезает длинный промпт
+    # с начала — вместе с инструкцией и вопросом
+    return {"num_ctx": model_context(model_name)}
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(family: str):
+    name = MODEL_TOKENIZERS.get(family)
+    if name:
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(name, local_files_only=not TOKENIZER_DOWNLOAD)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception as e:
+            print(f"⚠️ Токенизатор {name} недоступен ({e}) — длина оценивается по символам")
+    return lambda text: math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def preload_tokenizers(model_names) -> None:
+    # Загрузка при старте приложения, а не при первом вопросе
+    for family in {model_family(m) for m in model_names}:
+        get_tokenizer(family)
+
+
+@lru_cache(maxsize=NORM_TOKEN_CACHE_SIZE)
+def _count_tokens(family: str, text: str) -> int:
+    return get_tokenizer(family)(text)
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    # Кэш по тексту: одна и та же отформатированная норма токенизируется один раз
+    return _count_tokens(model_family(model_name), text)
+
+
+def pack_norm_batches(norms: list, model_name: str, format_norm, base_tokens: int, header=None,
+                      budget: int = None) -> list:
+    # Укладывает нормы в минимум промптов, не превышающих бюджет (first-fit decreasing).
+    # Нормы одной категории (group_norms_by_category) идут в один промпт; категория
+    # делится на части, только если сама не помещается в бюджет.
+    if not norms:
+        return []
+    budget = (budget or prompt_budget(model_name)) - base_tokens
+    budget = max(budget, 1)
+
+    items = []  # (токены, нормы) — неделимые куски для укладки
+    for category, group in group_norms_by_category(norms).items():
+        # +2 — пустая строка перед заголовком категории и перевод строки после него
+        header_tokens = count_tokens(header(category), model_name) + 2 if header else 0
+        chunk, chunk_tokens = [], header_tokens
+        for norm in group:
+            tokens = count_tokens(format_norm(norm), model_name) + 1  # +1 — перевод строки
+            if chunk and chunk_tokens + tokens > budget:
+                items.append((chunk_tokens, chunk))
+                chunk, chunk_tokens = [], header_tokens
+            chunk.append(norm)
+            chunk_tokens += tokens
+        items.append((chunk_tokens, chunk))
+
+    bins = []  # [токены, нормы]
+    for tokens, chunk in sorted(items, key=lambda item: -item[0]):
+        for b in bins:
+            if b[0] + tokens <= budget:
+                b[0] += tokens
+                b[1].extend(chunk)
+                break
+        else:
+            bins.append([tokens, list(chunk)])
+
+    print(f"📦 {len(norms)} норм → {len(bins)} промпт(ов), бюджет {budget + base_tokens} токенов "
+          f"({', '.join(str(b[0] + base_tokens) for b in bins)})")
+    return [b[1] for b in bins]
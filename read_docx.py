@@ -1,8 +1,10 @@
-import requests
 import time
 import re
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_client import stream_generate, get_client, LLM_CONCURRENCY
+from llm_orchestrator import MapTask, run_map_reduce
+from prompt_packer import context_options, count_tokens, pack_norm_batches
+
 def dedup_text_norms(norms):
     seen = set()
     deduped = []
@@ -90,7 +92,7 @@ def generate_combined_prompt(text_norms, table_norms, user_question):
         return f"❌ Ошибка при финальном суммировании: {e}"
 """
 
-def summarize_llm_batches(responses, question, model_name="qwen3"):
+def summarize_llm_batches(responses, question, model_name="qwen3", on_token=None, on_stats=None):
     if not responses:
         return "❗ Нет промежуточных ответов для суммирования."
 
@@ -102,17 +104,28 @@ def summarize_llm_batches(responses, question, model_name="qwen3"):
         "**📌 Финальный ответ:**"
     )
 
+    return call_llm(prompt, model_name=model_name, on_token=on_token, on_stats=on_stats)
+
+def merge_llm_batches(responses, question, model_name="qwen3"):
+    # Промежуточный reduce: сжимает несколько ответов в один, не теряя пунктов норм
+    combined = "\n\n".join([f"Ответ {i+1}:\n{resp}" for i, resp in enumerate(responses)])
+    prompt = (
+        "Ты — помощник архитектора. Объедини несколько промежуточных ответов в один.\n"
+        "Сохрани все требования, числовые значения и ссылки на пункты норм, убери повторы. Ничего не добавляй от себя.\n\n"
+        f"Вопрос архитектора:\n{question.strip()}\n\n"
+        f"{combined}\n\n"
+        "**📌 Объединённый ответ:**"
+    )
     return call_llm(prompt, model_name=model_name)
 
-def call_llm(prompt, model_name="mistral"):
+def call_llm(prompt, model_name="mistral", on_token=None, on_stats=None):
     try:
-        response = requests.post("http://localhost:11434/api/generate", json={
-            "model": model_name,
-            "prompt": prompt,
-            "stream": False
-        })
-        response.raise_for_status()
-        return clean_llm_output(response.json().get("response", "❌ Пустой ответ от модели"))
+        if on_token or on_stats:
+            # Потоковый режим: токены уходят в UI сразу, <think> вырезается на лету
+            return stream_generate(prompt, model_name, on_token=on_token, on_stats=on_stats,
+                                   options=context_options(model_name), use_cache=True)
+        response = get_client().generate(prompt, model_name, options=context_options(model_name), use_cache=True)
+        return clean_llm_output(response.get("response", "❌ Пустой ответ от модели"))
     except Exception as e:
         return f"❌ Ошибка при вызове модели: {e}"
 
@@ -121,9 +134,10 @@ def check_multi_norms_combined_with_llama_parallel(
     table_norms: list,
     fact_text: str,
     model_name="mistral",
-    max_workers=4,
+    max_workers=LLM_CONCURRENCY,
     progress_bar=None,
-    progress_label=None
+    progress_label=None,
+    answer_placeholder=None
 ):
     if not text_norms and not table_norms:
         return "❗ Нормативы не переданы, проверка невозможна."
@@ -132,73 +146,53 @@ def check_multi_norms_combined_with_llama_parallel(
     text_norms = dedup_text_norms(text_norms)
     table_norms = dedup_table_norms(table_norms)
 
-    all_responses = []
     start_time = time.time()
 
-    # === ТЕКСТОВЫЕ НОРМЫ ===
-    def process_text_batch(batch):
-        prompt = generate_combined_prompt(batch, [], fact_text)
-        return call_llm(prompt, model_name=model_name)
-
-    text_batches = list(split_into_batches(text_norms, 8))
+    base_tokens = count_tokens(generate_combined_prompt([], [], fact_text), model_name)
+    text_batches = pack_norm_batches(text_norms, model_name, format_text_norm, base_tokens)
     print(f"📝 Текстовых норм: {len(text_norms)}, батчей: {len(text_batches)}")
-    table_batches = list(split_into_batches(table_norms, 8))
+    table_batches = pack_norm_batches(table_norms, model_name, format_table_norm, base_tokens)
     print(f"📊 Табличных норм: {len(table_norms)}, батчей: {len(table_batches)}")
-    total_batches = len(text_batches) + len(table_batches)
-    progress_count = 0
-    def update_progress(label=None):
-        nonlocal progress_count
-        progress_count += 1
-        fraction = progress_count / total_batches
+
+    # === Текстовые и табличные батчи — одной очередью с общим лимитом параллельности
+    tasks = []
+    for batch in text_batches:
+        tasks.append(MapTask(len(tasks) + 1, "text", generate_combined_prompt(batch, [], fact_text), model_name, batch))
+    for batch in table_batches:
+        tasks.append(MapTask(len(tasks) + 1, "table", generate_combined_prompt([], batch, fact_text), model_name, batch))
+
+    def on_result(result, done, total):
+        fraction = done / total
         if progress_bar:
             progress_bar.progress(fraction)
-        if progress_label and label:
-            percent = int(fraction * 100)
-            progress_label.text(f"{label} — {percent}%")
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_text_batch, batch): i for i, batch in enumerate(text_batches, 1)}
-        for future in as_completed(futures):
-            idx = futures[future]
-            try:
-                result = future.result()
-                print("====")
-                print(result)
-                all_responses.append(result)
-                update_progress()
-                print(f"✅ Текстовый батч {idx} завершён.")
-            except Exception as e:
-                print(f"❌ Ошибка в текстовом батче {idx}: {e}")
-                all_responses.append(f"❌ Ошибка в текстовом батче {idx}: {e}")
-
-
-    # === ТАБЛИЧНЫЕ НОРМЫ ===
-    def process_table_batch(batch):
-        prompt = generate_combined_prompt([], batch, fact_text)
-        return call_llm(prompt, model_name=model_name)
-
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_table_batch, batch): i for i, batch in enumerate(table_batches, 1)}
-        for future in as_completed(futures):
-            idx = futures[future]
-            try:
-                result = future.result()
-                print("====")
-                print(result)
-                all_responses.append(result)
-                print(f"✅ Табличный батч {idx} завершён.")
-                update_progress()
-            except Exception as e:
-                print(f"❌ Ошибка в табличном батче {idx}: {e}")
-                all_responses.append(f"❌ Ошибка в табличном батче {idx}: {e}")
+        if progress_label:
+            progress_label.text(f"Обработано {done} из {total} батчей — {int(fraction * 100)}%")
 
     # === Финальное суммирование
-    elapsed = time.time() - start_time
-    print(f"\n🏁 Все батчи обработаны за {round(elapsed, 2)} сек.")
     print(f"Вопрос архитектора: {fact_text}")
 
-    if all_responses:
-        return clean_llm_output(summarize_llm_batches(all_responses, fact_text, model_name=model_name))
-    else:
-        return "❗ Нет ответов для генерации."
\ No newline at end of file
+    streamed = []
+    def on_token(delta):
+        streamed.append(delta)
+        answer_placeholder.markdown("".join(streamed) + "▌")
+
+    def on_stats(stats):
+        if progress_label and stats["ttft_s"] is not None:
+            progress_label.text(f"✍️ Финальный ответ: первый токен через {stats['ttft_s']:.1f} с")
+
+    def merge(texts):
+        return merge_llm_batches(texts, fact_text, model_name=model_name)
+
+    def reduce(all_responses, results):
+        print(f"\n🏁 Все батчи обработаны за {round(time.time() - start_time, 2)} сек.")
+        if not all_responses:
+            return "❗ Нет ответов для генерации."
+        return clean_llm_output(summarize_llm_batches(
+            all_responses, fact_text, model_name=model_name,
+            on_token=on_token if answer_placeholder else None,
+            on_stats=on_stats if answer_placeholder else None,
+        ))
+
+    answer, _ = run_map_reduce(tasks, call_llm, reduce, concurrency=max_workers, on_result=on_result,
+                               merge_fn=merge, count_fn=lambda t: count_tokens(t, model_name))
+    return answer
\ No newline at end of file
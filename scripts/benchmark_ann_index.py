@@ -0,0 +1,56 @@
+# scripts/benchmark_ann_index.py
+# Сравнение конфигураций ANN-индекса (recall@k и задержка) с точным Flat-поиском
+import argparse
+import json
+import sys
+
+import faiss
+
+from ann_index import report_index_specs, print_index_report, REPORT_TOP_K, REPORT_QUERIES, COMPACT_MIN_OVERLAP
+
+DEFAULT_SPECS = [
+    "Flat",
+    "HNSW:M=16,efSearch=32",
+    "HNSW:M=32,efSearch=64",
+    "IVFFlat:nlist=64,nprobe=8",
+    "IVFFlat:nlist=256,nprobe=16",
+    "IVFPQ:nlist=64,m=16,nprobe=8",
+    "SQfp16:rerank=2",
+    "SQ8:rerank=4",
+    "PQ:m=48,rerank=8",
+]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("index", help="путь к существующему (Flat) индексу, например index/class_norms_merged.index")
+    p.add_argument("--spec", action="append", help="конфигурация индекса, можно указать несколько раз")
+    p.add_argument("--k", type=int, default=REPORT_TOP_K, help="глубина recall@k")
+    p.add_argument("--queries", type=int, default=REPORT_QUERIES, help="число тестовых запросов")
+    p.add_argument("--out", default=None, help="куда сохранить отчёт JSON")
+    p.add_argument("--min-overlap", type=float, default=None,
+                   help=f"проверка: код возврата 1, если recall@k ниже порога (обычно {COMPACT_MIN_OVERLAP})")
+    args = p.parse_args()
+
+    index = faiss.read_index(args.index)
+    vectors = index.reconstruct_n(0, index.ntotal)
+    print(f"📦 {args.index}: {index.ntotal} векторов, размерность {index.d}")
+
+    rows = report_index_specs(vectors, args.spec or DEFAULT_SPECS, k=args.k, n_queries=args.queries)
+    print_index_report(rows)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт сохранён: {args.out}")
+
+    if args.min_overlap is not None:
+        failed = [r["spec"] for r in rows if r["recall_at_k"] < args.min_overlap]
+        if failed:
+            print(f"❌ Ниже порога {args.min_overlap}: {', '.join(failed)}")
+            sys.exit(1)
+        print(f"✅ Все конфигурации не ниже порога {args.min_overlap}")
+
+
+if __name__ == "__main__":
+    main()
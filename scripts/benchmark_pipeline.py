@@ -0,0 +1,210 @@
+# scripts/benchmark_pipeline.py
+# Сквозной бенчмарк retrieve → map → reduce против stub-сервера Ollama (или настоящего по --url):
+# p50/p95 задержки, пропускная способность и число вызовов для разных бюджетов батча и числа воркеров
+import argparse
+import json
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+import llm_client
+import new_model_check
+import prompt_packer
+from llm_admission import AdmissionController, set_llm_session
+from llm_client import OllamaClient
+from llm_orchestrator import MAP_DEADLINE
+from model_routing import FALLBACK_ROUTES, MODEL_ROUTES
+from new_model_check import check_multi_norms_mistral_nemo_parallel4
+from norm_pruning import prune_hits
+from norm_rag import NormRAG
+from scripts.stub_ollama import StubConfig, start_stub_server
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+TEXT_TOP_K = 32
+TABLE_TOP_K = 15
+DEFAULT_QUESTIONS = [
+    "минимальная ширина марша лестницы в жилом доме",
+    "высота ограждения балкона",
+    "площадь кухни в квартире",
+    "требования к эвакуационным выходам из подвала",
+    "освещённость классов в школе",
+    "ширина коридора в детском саду",
+]
+DEFAULT_BUDGETS = [1024, 2048, 4096]
+DEFAULT_WORKERS = [1, 2, 4]
+
+
+def load_questions(path) -> list:
+    if not path:
+        return DEFAULT_QUESTIONS
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def retrieve(rag: NormRAG, search_table_norms, question: str):
+    # Тот же путь, что в app.py: гибридный поиск + отсечение слабых норм
+    text_hits = rag.query(question, top_k=TEXT_TOP_K, with_scores=True)
+    table_hits = search_table_norms(question, top_k=TABLE_TOP_K, with_scores=True)
+    text_norms, _ = prune_hits(text_hits)
+    table_norms, _ = prune_hits(table_hits)
+    return text_norms, table_norms
+
+
+def run_question(rag, search_table_norms, question: str, session: str = "bench", deadline=MAP_DEADLINE) -> dict:
+    set_llm_session(session)
+    started = time.perf_counter()
+    text_norms, table_norms = retrieve(rag, search_table_norms, question)
+    retrieved = time.perf_counter()
+    report = {}
+    answer = check_multi_norms_mistral_nemo_parallel4(text_norms, table_norms, question, sourse=None,
+                                                      deadline=deadline, report=report)
+    finished = time.perf_counter()
+    return {
+        "latency_s": finished - started,
+        "retrieve_s": retrieved - started,
+        "llm_s": finished - retrieved,
+        "ok": bool(answer) and not answer.lstrip().startswith(("❌", "❗")),
+        "norms": len(text_norms) + len(table_norms),
+        "answer": answer,
+        "omitted": len(report.get("omitted", [])),
+    }
+
+
+def stub_stats(url: str) -> dict:
+    try:
+        return requests.get(url.replace("/api/generate", "/api/stub/stats"), timeout=5).json()
+    except Exception:
+        return {}
+
+
+def run_config(rag, search_table_norms, questions: list, url: str, budget: int, workers: int,
+               sessions: int, repeat: int, deadline=MAP_DEADLINE) -> dict:
+    # Конфигурация задаётся через модульные настройки — как их видит приложение
+    for model_name in set(MODEL_ROUTES.values()) | set(FALLBACK_ROUTES.values()):
+        family = prompt_packer.model_family(model_name)
+        prompt_packer.MODEL_CONTEXT[family] = budget + prompt_packer.RESPONSE_RESERVE
+    new_model_check.LLM_CONCURRENCY = workers
+    admission = AdmissionController()
+    client = OllamaClient(url=url, pool_size=admission.max_limit, cache=None, admission=admission)
+    llm_client._client = client
+    before = stub_stats(url)
+
+    jobs = [q for _ in range(repeat) for q in questions]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        runs = list(executor.map(lambda j: run_question(rag, search_table_norms, jobs[j], f"s{j % sessions}", deadline),
+                                 range(len(jobs))))
+    wall = time.perf_counter() - started
+
+    after = stub_stats(url)
+    latencies = [r["latency_s"] for r in runs]
+    by_model = client.metrics.summary()
+    calls = {key: sum(m.get(key, 0) for m in by_model.values())
+             for key in ("calls", "errors", "retries", "prompt_eval_total_s")}
+    gate = admission.stats()
+    return {
+        "budget": budget,
+        "workers": workers,
+        "sessions": sessions,
+        "questions": len(runs),
+        "failed": sum(1 for r in runs if not r["ok"]),
+        "partial": sum(1 for r in runs if r["omitted"]),
+        "omitted_batches": sum(r["omitted"] for r in runs),
+        "p50_s": round(float(np.percentile(latencies, 50)), 3),
+        "p95_s": round(float(np.percentile(latencies, 95)), 3),
+        "retrieve_p50_s": round(float(np.percentile([r["retrieve_s"] for r in runs], 50)), 3),
+        "throughput_qps": round(len(runs) / wall, 3),
+        "llm_calls": calls.get("calls", 0),
+        "calls_per_question": round(calls.get("calls", 0) / len(runs), 2),
+        "llm_errors": calls.get("errors", 0),
+        "llm_retries": calls.get("retries", 0),
+        "prompt_eval_total_s": round(calls.get("prompt_eval_total_s", 0.0), 3),
+        "calls_by_model": {model: m.get("calls", 0) for model, m in by_model.items()},
+        "admission_limit": gate["limit"],
+        "admission_wait_p95_s": gate["wait_p95_s"],
+        "stub_failures": after.get("failures", 0) - before.get("failures", 0),
+        "stub_cached_prompt_tokens": after.get("cached_prompt_tokens", 0) - before.get("cached_prompt_tokens", 0),
+        "answers": [r["answer"] for r in runs],
+    }
+
+
+def print_rows(rows: list):
+    header = f"{'бюджет':>7} {'воркеры':>7} {'сессии':>6} {'p50, с':>8} {'p95, с':>8} {'вопр/с':>7} {'вызовов/вопр':>12} {'ошибок':>6} {'неполных':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['budget']:>7} {r['workers']:>7} {r['sessions']:>6} {r['p50_s']:>8.2f} {r['p95_s']:>8.2f} "
+              f"{r['throughput_qps']:>7.2f} {r['calls_per_question']:>12.2f} {r['llm_errors']:>6} {r['partial']:>8}")
+
+
+def run_checklist(url: str, norms: list) -> dict:
+    from scripts.convert_norms_to_checklist import convert_norms_to_checklist
+    client = OllamaClient(url=url, cache=None)
+    llm_client._client = client
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        convert_norms_to_checklist(norms, Path(tmp) / "checklist.json")
+        wall = time.perf_counter() - started
+    summary = next(iter(client.metrics.summary().values()), {})
+    return {"norms": len(norms), "wall_s": round(wall, 2), "llm_calls": summary.get("calls", 0),
+            "p50_s": summary.get("p50_s"), "p95_s": summary.get("p95_s")}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--questions", default=None, help="файл с вопросами, по одному на строку")
+    p.add_argument("--budget", type=int, action="append", help="бюджет промпта map-батча в токенах (несколько раз)")
+    p.add_argument("--workers", type=int, action="append", help="параллельных LLM-вызовов на вопрос (несколько раз)")
+    p.add_argument("--sessions", type=int, default=1, help="одновременно обрабатываемых вопросов")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--deadline", type=float, default=MAP_DEADLINE, help="сек. на map-этап вопроса (0 — без дедлайна)")
+    p.add_argument("--url", default=None, help="настоящий Ollama вместо stub, например http://localhost:11434/api/generate")
+    p.add_argument("--token-latency", type=float, default=0.02)
+    p.add_argument("--prompt-eval", type=float, default=0.0005)
+    p.add_argument("--stub-concurrency", type=int, default=1, help="как OLLAMA_NUM_PARALLEL")
+    p.add_argument("--fail-rate", type=float, default=0.0)
+    p.add_argument("--checklist", type=int, default=0, help="дополнительно прогнать convert_norms_to_checklist на N нормах")
+    p.add_argument("--out", default=None, help="куда сохранить отчёт JSON")
+    args = p.parse_args()
+
+    url = args.url
+    if not url:
+        config = StubConfig(token_latency=args.token_latency, prompt_eval_per_token=args.prompt_eval,
+                            concurrency=args.stub_concurrency, fail_rate=args.fail_rate, seed=0)
+        server = start_stub_server(config)
+        url = f"http://127.0.0.1:{server.server_port}/api/generate"
+        print(f"🧪 Stub Ollama: {url}")
+
+    from scripts.search_class_norms import search as search_table_norms
+    rag = NormRAG(base_dir=BASE_DIR)
+    questions = load_questions(args.questions)
+
+    rows = []
+    for budget in args.budget or DEFAULT_BUDGETS:
+        for workers in args.workers or DEFAULT_WORKERS:
+            print(f"\n▶️ бюджет {budget} токенов, воркеров {workers}")
+            rows.append(run_config(rag, search_table_norms, questions, url, budget, workers, args.sessions, args.repeat,
+                                   args.deadline or None))
+    print()
+    print_rows(rows)
+
+    report = {"url": url, "configs": rows}
+    if args.checklist:
+        norms = [rag.norms[i] for i in range(min(args.checklist, len(rag.norms)))]
+        report["checklist"] = run_checklist(url, norms)
+        print(f"\n📋 Чеклист: {report['checklist']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт сохранён: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,15 @@
 # scripts/build_index.py
 import os
 import json
-import faiss
 import numpy as np
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
+from ann_index import build_faiss_index, save_faiss_index, save_index_report, DEFAULT_INDEX_SPEC
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 NORM_FILE = BASE_DIR / "extracted" / "norms.json"
 INDEX_FILE = BASE_DIR / "index" / "norms.index"
+INDEX_SPEC = DEFAULT_INDEX_SPEC  # например "HNSW:M=32,efSearch=64", "IVFFlat:nlist=256,nprobe=16" или компактный "SQ8:rerank=4"
 
 os.makedirs(INDEX_FILE.parent, exist_ok=True)
 
@@ -24,11 +25,11 @@ texts = [item["text"] for item in norms]
 vectors = model.encode(texts, show_progress_bar=True)
 
 # Создаём FAISS индекс
-index = faiss.IndexFlatL2(len(vectors[0]))
-index.add(np.array(vectors))
+index = build_faiss_index(np.array(vectors), INDEX_SPEC)
 
 # Сохраняем
-faiss.write_index(index, str(INDEX_FILE))
+save_faiss_index(index, INDEX_FILE, INDEX_SPEC)
+save_index_report(np.array(vectors), INDEX_SPEC, INDEX_FILE)
 
 # Сохраняем тексты отдельно
 with open(INDEX_FILE.with_suffix(".json"), "w", encoding="utf-8") as f:
@@ -2,14 +2,15 @@
 
 import os
 import json
-import faiss
 import numpy as np
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
+from ann_index import build_faiss_index, save_faiss_index, save_index_report, DEFAULT_INDEX_SPEC
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # поднимаемся на 1 уровень выше
 SOURCE = BASE_DIR / "extracted" / "norms_checklist.json"
 INDEX_PATH = BASE_DIR / "index" / "norms_checklist_v2.index"
+INDEX_SPEC = DEFAULT_INDEX_SPEC  # например "HNSW:M=32,efSearch=64", "IVFPQ:nlist=256,m=16,nprobe=16" или компактный "SQ8:rerank=4"
 os.makedirs(INDEX_PATH.parent, exist_ok=True)
 
 model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
@@ -30,11 +31,11 @@ combined_texts = [combine_fields(n) for n in norms]
 vectors = model.encode(combined_texts, show_progress_bar=True)
 
 # Создание индекса
-index = faiss.IndexFlatL2(vectors.shape[1])
-index.add(np.array(vectors).astype("float32"))
+index = build_faiss_index(np.array(vectors).astype("float32"), INDEX_SPEC)
 
 # Сохраняем
-faiss.write_index(index, str(INDEX_PATH))
+save_faiss_index(index, INDEX_PATH, INDEX_SPEC)
+save_index_report(np.array(vectors).astype("float32"), INDEX_SPEC, INDEX_PATH)
 
 # Сохраняем норму с комбинированным полем
 for norm, text in zip(norms, combined_texts):
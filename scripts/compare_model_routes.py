@@ -0,0 +1,130 @@
+# scripts/compare_model_routes.py
+# Сравнение маршрутизации моделей по этапам (map / merge / reduce): задержка, пропускная способность
+# и грубая оценка качества — совпадение цитируемых пунктов норм с ответами эталонной конфигурации
+import argparse
+import json
+import re
+import sys
+
+import model_routing
+from norm_rag import NormRAG
+from scripts.benchmark_pipeline import BASE_DIR, load_questions, run_config
+from scripts.stub_ollama import StubConfig, parse_model_speed, start_stub_server
+
+CLAUSE = re.compile(r"\b\d+(?:\.\d+)+\b")
+# Первая конфигурация — эталон качества
+DEFAULT_CONFIGS = [
+    {"name": "large", "routes": {}, "fallback": False},
+    {"name": "small-map", "routes": {"map_text": "mistral", "map_table": "mistral", "merge": "mistral"}, "fallback": False},
+    {"name": "large+fallback", "routes": {}, "fallback": True},
+]
+DEFAULT_STUB_SPEED = {"mistral": 0.4}
+
+
+def parse_config(spec: str) -> dict:
+    # "имя:этап=модель,этап=модель[,fallback]"
+    name, _, rest = spec.partition(":")
+    config = {"name": name, "routes": {}, "fallback": False}
+    for item in filter(None, rest.split(",")):
+        if item == "fallback":
+            config["fallback"] = True
+            continue
+        stage, _, model = item.partition("=")
+        if stage not in model_routing.MODEL_ROUTES:
+            raise ValueError(f"Неизвестный этап: {stage}")
+        config["routes"][stage] = model
+    return config
+
+
+def cited_clauses(answer: str) -> set:
+    return set(CLAUSE.findall(answer or ""))
+
+
+def clause_overlap(answer: str, reference: str) -> float:
+    a, b = cited_clauses(answer), cited_clauses(reference)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def run_route(rag, search_table_norms, questions, url, config, args) -> dict:
+    routes, fallback_depth = dict(model_routing.MODEL_ROUTES), model_routing.FALLBACK_QUEUE_DEPTH
+    model_routing.MODEL_ROUTES.update(config["routes"])
+    if not config["fallback"]:
+        model_routing.FALLBACK_QUEUE_DEPTH = None
+    try:
+        row = run_config(rag, search_table_norms, questions, url, args.budget, args.workers, args.sessions, args.repeat)
+    finally:
+        model_routing.MODEL_ROUTES.clear()
+        model_routing.MODEL_ROUTES.update(routes)
+        model_routing.FALLBACK_QUEUE_DEPTH = fallback_depth
+    row["name"] = config["name"]
+    row["routes"] = {**routes, **config["routes"]}
+    return row
+
+
+def add_quality(rows: list):
+    reference = rows[0]["answers"]
+    for row in rows:
+        overlaps = [clause_overlap(a, r) for a, r in zip(row["answers"], reference)]
+        row["clause_overlap"] = round(sum(overlaps) / len(overlaps), 3) if overlaps else 0.0
+        row["answer_chars"] = round(sum(len(a or "") for a in row["answers"]) / max(1, len(row["answers"])))
+
+
+def print_rows(rows: list):
+    header = f"{'конфигурация':<16} {'p50, с':>8} {'p95, с':>8} {'вопр/с':>7} {'ошибок':>6} {'пункты≈':>8} {'символов':>8}  вызовы по моделям"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['name']:<16} {r['p50_s']:>8.2f} {r['p95_s']:>8.2f} {r['throughput_qps']:>7.2f} "
+              f"{r['failed']:>6} {r['clause_overlap']:>8.2f} {r['answer_chars']:>8}  {r['calls_by_model']}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--config", action="append", default=[],
+                   help="имя:этап=модель,...[,fallback] (несколько раз; первая — эталон качества)")
+    p.add_argument("--questions", default=None, help="файл с вопросами, по одному на строку")
+    p.add_argument("--budget", type=int, default=2048)
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--sessions", type=int, default=2)
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--url", default=None, help="настоящий Ollama вместо stub, например http://localhost:11434/api/generate")
+    p.add_argument("--token-latency", type=float, default=0.02)
+    p.add_argument("--stub-concurrency", type=int, default=2)
+    p.add_argument("--model-speed", action="append", default=[], metavar="MODEL=K",
+                   help="множитель задержек модели в stub (по умолчанию mistral=0.4)")
+    p.add_argument("--out", default=None, help="куда сохранить отчёт JSON")
+    args = p.parse_args()
+
+    url = args.url
+    if not url:
+        speed = parse_model_speed(args.model_speed) or DEFAULT_STUB_SPEED
+        server = start_stub_server(StubConfig(token_latency=args.token_latency, concurrency=args.stub_concurrency,
+                                              seed=0, model_speed=speed))
+        url = f"http://127.0.0.1:{server.server_port}/api/generate"
+        print(f"🧪 Stub Ollama: {url} (скорость моделей: {speed})")
+
+    from scripts.search_class_norms import search as search_table_norms
+    rag = NormRAG(base_dir=BASE_DIR)
+    questions = load_questions(args.questions)
+    configs = [parse_config(c) for c in args.config] or DEFAULT_CONFIGS
+
+    rows = []
+    for config in configs:
+        print(f"\n▶️ {config['name']}: {config['routes'] or 'маршруты по умолчанию'}"
+              f"{' + подмена при очереди' if config['fallback'] else ''}")
+        rows.append(run_route(rag, search_table_norms, questions, url, config, args))
+    add_quality(rows)
+    print()
+    print_rows(rows)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "configs": rows}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт сохранён: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,9 @@
 import json5
 import json
-import requests
 import time
 from pathlib import Path
+from llm_client import get_client
+from model_routing import route_model
 
 def chunked(lst, n):
     for i in range(0, len(lst), n):
@@ -39,13 +40,12 @@ def generate_checklist_prompt(norms):
     {norm_texts}
     """
 
-def create_check_list_with_model(prompt, model_name="mistral"):
-    response = requests.post("http://localhost:11434/api/generate", json={
-        "model": model_name,
-        "prompt": prompt,
-        "stream": False
-    })
-    return response.json().get("response", "")
+def create_check_list_with_model(prompt, model_name=None):
+    try:
+        return get_client().generate(prompt, model_name or route_model("checklist")).get("response", "")
+    except Exception as e:
+        # Ответ с "❌" запускает повтор в convert_norms_to_checklist
+        return f"❌ Ошибка при вызове модели: {e}"
 
 def clean_json_like_text(text):
     text = text.strip("` \n")
@@ -1,7 +1,6 @@
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
 import pickle
-import faiss
 import json
 from pathlib import Path
 
@@ -12,9 +11,14 @@ META = Path("index/class_norms_meta.pkl")
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer  # (можно удалить, если не используешь)
 import pickle
-import faiss
 import json
 from pathlib import Path
+from ann_index import build_faiss_index, save_faiss_index, save_index_report, DEFAULT_INDEX_SPEC
+from norm_store import write_flat_records, write_norm_store
+from lexical_index import BM25Index, lexical_index_path
+
+INDEX_SPEC = DEFAULT_INDEX_SPEC  # например "HNSW:M=32,efSearch=64", "IVFFlat:nlist=64,nprobe=8" или компактный "SQ8:rerank=4"
+
 def guess_room_type(indicator, values_dict):
     text = indicator.lower() + " " + " ".join(values_dict.values()).lower()
 
@@ -30,7 +34,7 @@ def guess_room_type(indicator, values_dict):
         return "балкон"
     return "помещение"
 
-def build_class_norms_index(input_json: Path):
+def build_class_norms_index(input_json: Path, index_spec=INDEX_SPEC):
     output_dir = Path("extracted/")
     with open(input_json, "r", encoding="utf-8") as f:
         data = json.load(f)
@@ -71,16 +75,19 @@ def build_class_norms_index(input_json: Path):
     print(f"✅ Добавлено: {len(metadatas)}")
 
     embeddings = model.encode(texts, convert_to_numpy=True)
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings)
+    index = build_faiss_index(embeddings, index_spec)
 
     output_dir.mkdir(parents=True, exist_ok=True)
     index_path = output_dir / "class_norms_merged.index"
     meta_path = output_dir / "class_norms_merged.pkl"
 
-    faiss.write_index(index, str(index_path))
+    save_faiss_index(index, index_path, index_spec)
+    save_index_report(embeddings, index_spec, index_path)
     with open(meta_path, "wb") as f:
         pickle.dump(metadatas, f)
+    write_flat_records(metadatas, meta_path)
+    write_norm_store(metadatas, meta_path)
+    BM25Index.build(metadatas).save(lexical_index_path(meta_path))
 
     print(f"✅ Индекс сохранён: {index_path}")
     print(f"🧠 Метаданные: {meta_path}")
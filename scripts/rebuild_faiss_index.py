@@ -1,15 +1,22 @@
 # scripts/rebuild_faiss_index.py
 
 import json
-import faiss
 import numpy as np
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
+from ann_index import build_faiss_index, save_faiss_index, save_index_report, DEFAULT_INDEX_SPEC
+from norm_store import write_flat_records, write_norm_store
+from lexical_index import BM25Index, lexical_index_path
+from norm_rag import (
+    build_applies_to_vocab, save_applies_to_vocab, applies_to_vocab_path,
+    build_facet_index, save_facet_index, facets_path, index_files_version,
+)
 
 # === Пути ===
 BASE_DIR = Path(__file__).resolve().parent.parent
 NORM_PATH = BASE_DIR / "extracted" / "norms_checklist_merged.json"
 INDEX_PATH = BASE_DIR / "index" / "norms_checklist_merged.index"
+INDEX_SPEC = DEFAULT_INDEX_SPEC  # например "HNSW:M=32,efSearch=64", "IVFFlat:nlist=256,nprobe=16" или компактный "SQ8:rerank=4"
 
 
 # === Модель ===
@@ -26,18 +33,23 @@ texts = [n["text"] for n in norms if "text" in n and n["text"]]
 embeddings = model.encode(texts, show_progress_bar=True)
 
 # === Создание и сохранение индекса ===
-embedding_dim = embeddings.shape[1]
-index = faiss.IndexFlatL2(embedding_dim)
-index.add(np.array(embeddings).astype("float32"))
+index = build_faiss_index(np.array(embeddings).astype("float32"), INDEX_SPEC)
 
 INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
-faiss.write_index(index, str(INDEX_PATH))
+save_faiss_index(index, INDEX_PATH, INDEX_SPEC)
+save_index_report(np.array(embeddings).astype("float32"), INDEX_SPEC, INDEX_PATH)
+write_flat_records(norms, INDEX_PATH.with_suffix(".json"), source=NORM_PATH)
+write_norm_store(norms, INDEX_PATH.with_suffix(".json"), source=NORM_PATH)
+# Производные файлы — после индекса и записей: в них сохраняется версия этих файлов
+index_version = index_files_version(INDEX_PATH)
+save_applies_to_vocab(build_applies_to_vocab(norms, model), applies_to_vocab_path(INDEX_PATH), index_version)
+save_facet_index(build_facet_index(norms), facets_path(INDEX_PATH), index_version)
+BM25Index.build(norms).save(lexical_index_path(INDEX_PATH.with_suffix(".json")), index_version)
 
 print(f"✅ FAISS-индекс создан и сохранён: {INDEX_PATH}")
 
 
-def rebuild_index_from_norms(norms_path):
-    import faiss
+def rebuild_index_from_norms(norms_path, index_spec=INDEX_SPEC):
     from sentence_transformers import SentenceTransformer
     with open(norms_path, encoding="utf-8") as f:
         norms = json.load(f)
@@ -49,10 +61,15 @@ def rebuild_index_from_norms(norms_path):
 
     model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
     embeddings = model.encode(texts, show_progress_bar=True)
-    embedding_dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(embedding_dim)
-    index.add(embeddings.astype("float32"))
+    index = build_faiss_index(embeddings.astype("float32"), index_spec)
     index_path = Path("index/norms_checklist.index")
     index_path.parent.mkdir(parents=True, exist_ok=True)
-    faiss.write_index(index, str(index_path))
+    save_faiss_index(index, index_path, index_spec)
+    save_index_report(embeddings.astype("float32"), index_spec, index_path)
+    write_flat_records(norms, index_path.with_suffix(".json"), source=norms_path)
+    write_norm_store(norms, index_path.with_suffix(".json"), source=norms_path)
+    index_version = index_files_version(index_path)
+    save_applies_to_vocab(build_applies_to_vocab(norms, model), applies_to_vocab_path(index_path), index_version)
+    save_facet_index(build_facet_index(norms), facets_path(index_path), index_version)
+    BM25Index.build(norms).save(lexical_index_path(index_path.with_suffix(".json")), index_version)
     print("faiss_ondex обработал")
@@ -1,38 +1,63 @@
 #search_class_norms
-import faiss
-import pickle
 import json
 import torch
-from model_loader import load_sentence_transformer_model
+import numpy as np
+from model_loader import load_sentence_transformer_model, DEFAULT_MODEL_NAME
+from embedding_cache import get_query_embedding_cache
+from ann_index import load_faiss_index, cosine_scores
+from norm_store import load_records, fetch_rows, fetch_column, DEFAULT_LOAD_MODE
+from lexical_index import load_or_build_bm25, reciprocal_rank_fusion
 INDEX_PATH = "index/class_norms_merged.index"
 META_PATH = "index/class_norms_merged.pkl"
-MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+MODEL_NAME = DEFAULT_MODEL_NAME
+LOAD_MODE = DEFAULT_LOAD_MODE
+HYBRID = True  # BM25 + векторный поиск со слиянием RRF
 
 # Загружаем индекс и мета-данные
 print("📥 Загружаем индекс и модель...")
-index = faiss.read_index(INDEX_PATH)
-with open(META_PATH, "rb") as f:
-    metadata = pickle.load(f)
+index = load_faiss_index(INDEX_PATH, mmap=LOAD_MODE != "heap")
+metadata = load_records(META_PATH, LOAD_MODE)
+lexical = load_or_build_bm25(META_PATH, metadata) if HYBRID else None
+_metadata_sources = None
 
-model = load_sentence_transformer_model()
+def metadata_sources():
+    # Колонка источников нужна только для фильтра — читаем её при первом использовании
+    global _metadata_sources
+    if _metadata_sources is None:
+        _metadata_sources = np.array([s.strip() if isinstance(s, str) else "" for s in fetch_column(metadata, "source")], dtype=object)
+    return _metadata_sources
 
-def search(query, top_k=5, sources: list[str] = None):
-    embedding = model.encode([query])
-    distances, indices = index.search(embedding, top_k * 5)  # запас для фильтрации
+model = load_sentence_transformer_model(MODEL_NAME)
+embedding_cache = get_query_embedding_cache()
+
+def search(query, top_k=5, sources: list[str] = None, hybrid=HYBRID, with_scores=False):
+    return search_many([query], top_k=top_k, sources=sources, hybrid=hybrid, with_scores=with_scores)[0]
+
+def search_many(queries: list[str], top_k=5, sources: list[str] = None, hybrid=HYBRID, with_scores=False):
+    # with_scores — вместо норм пары (норма, косинусное сходство с запросом)
+    if not queries:
+        return []
+    embeddings = embedding_cache.encode(model, list(queries), MODEL_NAME)
+    distances, indices = index.search(embeddings, top_k * 5)  # запас для фильтрации
+
+    # Фильтр по источнику — одной маской на всю матрицу результатов
+    valid = (indices >= 0) & (indices < len(metadata))
+    allowed = None
+    if sources:
+        wanted = np.array([s.strip() for s in sources], dtype=object)
+        valid &= np.isin(metadata_sources()[np.where(valid, indices, 0)], wanted)
+        allowed = np.flatnonzero(np.isin(metadata_sources(), wanted))
 
     results = []
-    for idx in indices[0]:
-        if idx < len(metadata):
-            item = metadata[idx]
-            item_source = item.get("source", "").strip()
-
-            if sources:
-                if not any(item_source == s.strip() for s in sources):
-                    continue
-
-            results.append(item)
-            if len(results) >= top_k:
-                break
+    for query, embedding, row, mask in zip(queries, embeddings, indices, valid):
+        ids = row[mask][:top_k]
+        if hybrid and lexical is not None:
+            _, lexical_ids = lexical.search(query, top_k * 2, allowed)
+            ids = reciprocal_rank_fusion([row[mask][:top_k * 2], lexical_ids], top_k)
+        rows = fetch_rows(metadata, ids)
+        if with_scores:
+            rows = list(zip(rows, cosine_scores(index, embedding, ids).tolist()))
+        results.append(rows)
     return results
 
 if __name__ == "__main__":
@@ -0,0 +1,280 @@
+# scripts/stub_ollama.py
+# Локальная замена Ollama для бенчмарков без GPU: /api/generate (стрим и без),
+# задержка на токен, стоимость prompt eval с KV-кэшем префикса по слотам,
+# лимит параллельности и внедрение сбоев
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 2.5
+DEFAULT_ANSWER = (
+    "Согласно представленным нормам, требование выполняется при соблюдении указанных параметров. "
+    "Ширина, высота и площадь принимаются не менее значений, приведённых в пункте нормы; "
+    "при отсутствии данных в нормах ответ не может быть дан."
+)
+CHECKLIST_LINE = re.compile(r"^\s*\d+\.\s*\[([^\]]*)\]\s*(.*)$")
+
+
+class StubConfig:
+    def __init__(self, token_latency=0.02, prompt_eval_per_token=0.0005, load_time=0.0, concurrency=1,
+                 response_tokens=80, fail_rate=0.0, fail_status=503, drop_rate=0.0, think=False, seed=None,
+                 model_speed=None):
+        self.token_latency = token_latency                  # сек. на сгенерированный токен
+        self.prompt_eval_per_token = prompt_eval_per_token  # сек. на токен промпта вне кэша
+        self.load_time = load_time                          # сек. на «загрузку» модели при первом вызове
+        self.concurrency = concurrency                      # как OLLAMA_NUM_PARALLEL: остальные ждут
+        self.response_tokens = response_tokens
+        self.fail_rate = fail_rate                          # доля ответов с HTTP-ошибкой
+        self.fail_status = fail_status
+        self.drop_rate = drop_rate                          # доля стримов, оборванных на середине
+        self.think = think                                  # добавлять блок <think> в начало ответа
+        self.model_speed = model_speed or {}                # модель -> множитель задержек (0.5 — вдвое быстрее)
+        self.random = random.Random(seed)
+
+    def speed(self, model: str) -> float:
+        return self.model_speed.get(model, self.model_speed.get(model.split(":")[0], 1.0))
+
+
+def count_tokens(text: str) -> int:
+    return max(1, int(len(text) / CHARS_PER_TOKEN))
+
+
+def common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class StubState:
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.cond = threading.Condition()
+        self.slots = [None] * max(1, config.concurrency)   # последний промпт слота (KV-кэш)
+        self.busy = [False] * len(self.slots)
+        self.loaded = set()
+        self.stats = {
+            "requests": 0, "failures": 0, "drops": 0, "cancelled": 0, "active": 0, "max_active": 0,
+            "prompt_tokens": 0, "cached_prompt_tokens": 0, "generated_tokens": 0, "queue_wait_s": 0.0,
+        }
+
+    def acquire(self, prompt: str) -> tuple:
+        # Как в llama.cpp: свободный слот с самым длинным общим префиксом
+        started = time.perf_counter()
+        with self.cond:
+            while all(self.busy):
+                self.cond.wait()
+            free = [i for i, b in enumerate(self.busy) if not b]
+            slot = max(free, key=lambda i: common_prefix_len(self.slots[i] or "", prompt))
+            self.busy[slot] = True
+            cached = common_prefix_len(self.slots[slot] or "", prompt)
+            self.stats["active"] += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.stats["active"])
+            self.stats["queue_wait_s"] += time.perf_counter() - started
+        return slot, cached
+
+    def release(self, slot: int, prompt: str):
+        with self.cond:
+            self.slots[slot] = prompt
+            self.busy[slot] = False
+            self.stats["active"] -= 1
+            self.cond.notify()
+
+    def add(self, **values):
+        with self.cond:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return dict(self.stats)
+
+
+def make_answer(prompt: str, config: StubConfig) -> str:
+    # Промпт чеклиста (convert_norms_to_checklist) получает разбираемый JSON-массив
+    if "JSON-массив" in prompt:
+        items = []
+        for line in prompt.splitlines():
+            m = CHECKLIST_LINE.match(line)
+            if m:
+                items.append({
+                    "id": m.group(1), "text": m.group(2), "applies_to": ["все здания"],
+                    "condition": "", "requirement": m.group(2)[:80], "check": "", "domain": "архитектура",
+                })
+        answer = json.dumps(items, ensure_ascii=False)
+    else:
+        words = DEFAULT_ANSWER.split(" ")
+        answer = " ".join(words[i % len(words)] for i in range(config.response_tokens))
+    if config.think:
+        answer = "<think>проверяю нормы</think>" + answer
+    return answer
+
+
+def split_tokens(text: str) -> list:
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def make_handler(state: StubState):
+    config = state.config
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def handle(self):
+            # Клиент закрыл keep-alive соединение (новый пул, отмена) — не ошибка сервера
+            try:
+                super().handle()
+            except (ConnectionResetError, BrokenPipeError):
+                pass
+
+        def _json(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/stub/stats":
+                self._json(200, state.snapshot())
+            else:
+                self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/api/generate":
+                self._json(404, {"error": "not found"})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt, model = body.get("prompt", ""), body.get("model", "stub")
+            state.add(requests=1)
+
+            if config.random.random() < config.fail_rate:
+                state.add(failures=1)
+                self._json(config.fail_status, {"error": "stub: внедрённый сбой"})
+                return
+
+            slot, cached_chars = state.acquire(prompt)
+            try:
+                started = time.perf_counter()
+                load = 0.0
+                if model not in state.loaded:
+                    state.loaded.add(model)
+                    load = config.load_time
+                    time.sleep(load)
+                prompt_tokens = count_tokens(prompt)
+                cached_tokens = min(prompt_tokens, int(cached_chars / CHARS_PER_TOKEN))
+                eval_tokens = prompt_tokens - cached_tokens
+                speed = config.speed(model)
+                eval_s = eval_tokens * config.prompt_eval_per_token * speed
+                time.sleep(eval_s)
+                state.add(prompt_tokens=prompt_tokens, cached_prompt_tokens=cached_tokens)
+
+                tokens = split_tokens(make_answer(prompt, config))
+                final = {
+                    "model": model, "done": True, "done_reason": "stop",
+                    "prompt_eval_count": eval_tokens, "prompt_eval_duration": int(eval_s * 1e9),
+                    "eval_count": len(tokens), "load_duration": int(load * 1e9),
+                }
+                if body.get("stream", True):
+                    self._stream(tokens, final, started, config.token_latency * speed)
+                else:
+                    time.sleep(len(tokens) * config.token_latency * speed)
+                    final["eval_duration"] = int(len(tokens) * config.token_latency * speed * 1e9)
+                    final["total_duration"] = int((time.perf_counter() - started) * 1e9)
+                    self._json(200, {**final, "response": "".join(tokens)})
+                state.add(generated_tokens=len(tokens))
+            finally:
+                state.release(slot, prompt)
+
+        def _stream(self, tokens: list, final: dict, started: float, token_latency: float):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            drop_at = len(tokens) // 2 if config.random.random() < config.drop_rate else None
+
+            def write(obj):
+                line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            for i, token in enumerate(tokens):
+                if i == drop_at:
+                    state.add(drops=1)
+                    self.close_connection = True
+                    return
+                time.sleep(token_latency)
+                try:
+                    write({"model": final["model"], "response": token, "done": False})
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент закрыл соединение (отмена) — как Ollama, прекращаем генерацию
+                    state.add(cancelled=1)
+                    self.close_connection = True
+                    return
+            final["eval_duration"] = int(len(tokens) * token_latency * 1e9)
+            final["total_duration"] = int((time.perf_counter() - started) * 1e9)
+            write({**final, "response": ""})
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def start_stub_server(config: StubConfig = None, host="127.0.0.1", port=0):
+    # port=0 — свободный порт; адрес: f"http://{host}:{server.server_port}/api/generate"
+    state = StubState(config or StubConfig())
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_model_speed(items: list) -> dict:
+    speeds = {}
+    for item in items:
+        model, _, k = item.rpartition("=")
+        speeds[model] = float(k)
+    return speeds
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11434)
+    p.add_argument("--token-latency", type=float, default=0.02, help="сек. на сгенерированный токен")
+    p.add_argument("--prompt-eval", type=float, default=0.0005, help="сек. на токен промпта вне KV-кэша")
+    p.add_argument("--load-time", type=float, default=0.0, help="сек. на загрузку модели при первом вызове")
+    p.add_argument("--concurrency", type=int, default=1, help="одновременно обслуживаемых запросов")
+    p.add_argument("--response-tokens", type=int, default=80)
+    p.add_argument("--fail-rate", type=float, default=0.0, help="доля запросов с HTTP-ошибкой")
+    p.add_argument("--fail-status", type=int, default=503)
+    p.add_argument("--drop-rate", type=float, default=0.0, help="доля стримов, оборванных на середине")
+    p.add_argument("--think", action="store_true", help="добавлять <think>…</think> в ответ")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--model-speed", action="append", default=[], metavar="MODEL=K",
+                   help="множитель задержек модели, например mistral=0.5 (несколько раз)")
+    args = p.parse_args()
+
+    config = StubConfig(args.token_latency, args.prompt_eval, args.load_time, args.concurrency,
+                        args.response_tokens, args.fail_rate, args.fail_status, args.drop_rate, args.think, args.seed,
+                        parse_model_speed(args.model_speed))
+    server = start_stub_server(config, args.host, args.port)
+    print(f"🧪 Stub Ollama: http://{args.host}:{server.server_port}/api/generate (Ctrl+C — выход)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# single_flight.py
+import json
+import threading
+
+from embedding_cache import normalize_query_text
+
+FOLLOWER_POLL = 0.2   # сек. между обновлениями прогресса у присоединившихся сессий
+_ABANDONED = object() # ведущая сессия прервана (Stop/Rerun Streamlit) — результата не будет
+
+
+def flight_key(question: str, filters: str, index_version: str) -> str:
+    return json.dumps([normalize_query_text(question).lower(), filters, index_version], ensure_ascii=False)
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.state = {}       # последнее состояние элементов UI: bar / label / answer
+        self.version = 0
+        self.done = False
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+    def publish(self, element: str, value):
+        with self.cond:
+            self.state[element] = value
+            self.version += 1
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result, self.error, self.done = result, error, True
+            self.cond.notify_all()
+
+
+# Прокси элемента Streamlit у ведущей сессии: обновляет свой элемент и публикует
+# состояние для присоединившихся сессий (у них свои элементы и свои потоки)
+class _Broadcast:
+    def __init__(self, flight: _Flight, element: str, target):
+        self.flight = flight
+        self.element = element
+        self.target = target
+
+    def _publish(self, method: str, value):
+        if self.target is not None:
+            getattr(self.target, method)(value)
+        self.flight.publish(self.element, (method, value))
+
+    def progress(self, value):
+        self._publish("progress", value)
+
+    def text(self, value):
+        self._publish("text", value)
+
+    def markdown(self, value):
+        self._publish("markdown", value)
+
+
+# Одинаковые вопросы (с теми же фильтрами и версией индекса), заданные одновременно,
+# считаются один раз: остальные сессии ждут результат ведущей и видят её прогресс
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def run(self, key: str, fn, progress_bar=None, progress_label=None, answer_placeholder=None):
+        # fn(progress_bar, progress_label, answer_placeholder) -> результат.
+        # Возвращает (результат, joined): joined=True, если результат посчитан другой сессией
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    flight.followers += 1
+            if leader:
+                break
+
+            print(f"🔗 Присоединились к уже идущему расчёту ({flight.followers} ожидающих)")
+            result = self._follow(flight, progress_bar, progress_label, answer_placeholder)
+            if result is not _ABANDONED:
+                return result, True
+            # Ведущую сессию остановили или перезапустили — считаем сами (или ждём новую ведущую)
+            print("🔗 Ведущий расчёт прерван — запускаем заново")
+
+        result, error = None, None
+        try:
+            result = fn(
+                _Broadcast(flight, "bar", progress_bar),
+                _Broadcast(flight, "label", progress_label),
+                _Broadcast(flight, "answer", answer_placeholder) if answer_placeholder is not None else None,
+            )
+            return result, False
+        except BaseException as e:
+            # Включая StopException/RerunException Streamlit: они не наследуют Exception
+            error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.finish(result, error)
+
+    def _follow(self, flight: _Flight, progress_bar, progress_label, answer_placeholder):
+        targets = {"bar": progress_bar, "label": progress_label, "answer": answer_placeholder}
+        seen = -1
+        while True:
+            with flight.cond:
+                if flight.version == seen and not flight.done:
+                    flight.cond.wait(FOLLOWER_POLL)
+                seen, state, done = flight.version, dict(flight.state), flight.done
+            # Элементы UI обновляются в потоке этой сессии
+            for element, (method, value) in state.items():
+                if targets.get(element) is not None:
+                    getattr(targets[element], method)(value)
+            if done:
+                break
+        if flight.error is not None:
+            if not isinstance(flight.error, Exception):
+                return _ABANDONED
+            raise flight.error
+        return flight.result
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SingleFlight()
+        return _shared
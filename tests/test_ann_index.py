@@ -0,0 +1,91 @@
+# tests/test_ann_index.py
+# Выборочный фильтр (IDSelector) должен возвращать полный top_k для любого типа индекса:
+# HNSW/IVF сами видят только кандидатов efSearch/nprobe. Косинусные оценки для prune_hits —
+# по float-векторам и для индексов с квантованными кодами
+import faiss
+import numpy as np
+import pytest
+
+import ann_index
+from ann_index import build_faiss_index, cosine_scores, search_allowed
+
+SPECS = [
+    "Flat",
+    "HNSW:M=8,efSearch=16",
+    "IVFFlat:nlist=32,nprobe=1",
+    "IVFPQ:nlist=32,m=4,nbits=6,nprobe=1",
+    "SQ8",
+    "SQfp16",
+    "PQ:m=4,nbits=6",
+]
+TOP_K = 10
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 16)).astype("float32")
+    queries = rng.standard_normal((20, 16)).astype("float32")
+    allowed = np.sort(rng.choice(len(vectors), 20, replace=False)).astype("int64")
+    return vectors, queries, allowed
+
+
+def exact_top(vectors, queries, allowed, k):
+    dist = ((queries[:, None, :] - vectors[allowed][None]) ** 2).sum(axis=-1)
+    return allowed[np.argsort(dist, axis=1, kind="stable")[:, :k]]
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_selective_filter_returns_exact_top_k(data, spec):
+    vectors, queries, allowed = data
+    index = build_faiss_index(vectors, spec)
+
+    _, I = search_allowed(index, queries, TOP_K, allowed)
+
+    assert (I >= 0).all()
+    assert (I == exact_top(vectors, queries, allowed, TOP_K)).all()
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_filter_smaller_than_top_k(data, spec):
+    vectors, queries, allowed = data
+    index = build_faiss_index(vectors, spec)
+
+    _, I = search_allowed(index, queries, TOP_K, allowed[:3])
+
+    assert I.shape == (len(queries), 3)
+    assert (np.sort(I, axis=1) == allowed[:3]).all()
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_ann_path_pads_missing_rows(data, spec, monkeypatch):
+    # Фильтр «крупнее» порога идёт через IDSelector; строки с -1 добираются точным перебором
+    monkeypatch.setattr(ann_index, "EXACT_FILTER_MAX", 0)
+    vectors, queries, allowed = data
+    index = build_faiss_index(vectors, spec)
+
+    _, I = search_allowed(index, queries, TOP_K, allowed)
+
+    assert (I >= 0).all()
+    assert all(set(row) <= set(allowed) for row in I.tolist())
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_cosine_scores_use_float_vectors(data, spec):
+    # Пороги prune_hits рассчитаны на точное сходство, а не на декодированные PQ/SQ-коды
+    vectors, queries, allowed = data
+    index = build_faiss_index(vectors, spec)
+
+    scores = cosine_scores(index, queries[0], allowed)
+
+    expected = vectors[allowed] @ queries[0] / (np.linalg.norm(vectors[allowed], axis=1) * np.linalg.norm(queries[0]))
+    assert np.allclose(scores, expected, atol=1e-5)
+
+
+def test_raw_lossy_index_has_no_cosine_scores(data):
+    vectors, queries, allowed = data
+    index = build_faiss_index(vectors, "IVFPQ:nlist=32,m=4,nbits=6,nprobe=1").index
+    assert isinstance(index, faiss.IndexIVFPQ)
+
+    with pytest.raises(ValueError):
+        cosine_scores(index, queries[0], allowed)
@@ -0,0 +1,38 @@
+# tests/test_lexical_index.py
+from lexical_index import RRF_K, BM25Index, lexical_index_path, load_or_build_bm25, reciprocal_rank_fusion
+
+RECORDS = [
+    {"text": "Высота потолка жилой комнаты"},
+    {"text": "Ширина коридора"},
+]
+
+
+def test_bm25_of_other_index_version_is_rebuilt(tmp_path):
+    path = tmp_path / "norms.json"
+    BM25Index.build(RECORDS).save(lexical_index_path(path), "v1")
+    changed = [{"text": "Ширина коридора"}, {"text": "Высота потолка жилой комнаты"}]
+
+    assert load_or_build_bm25(path, changed, "v1").search("коридор", 1)[1].tolist() == [1]
+    # То же число записей, другая версия — строится заново и сохраняется с новой версией
+    assert load_or_build_bm25(path, changed, "v2").search("коридор", 1)[1].tolist() == [0]
+    assert BM25Index.load(lexical_index_path(path)).index_version == "v2"
+
+
+def test_rrf_prefers_documents_ranked_in_both_lists():
+    vector = [1, 2, 3, 4]
+    lexical = [3, 5, 1]
+    # 1: 1/61 + 1/63, 3: 1/63 + 1/61 — равны, порядок по id; 2 и 5 — только в одном списке
+    assert reciprocal_rank_fusion([vector, lexical], top_k=5) == [1, 3, 2, 5, 4]
+
+
+def test_rrf_weights_and_top_k():
+    fused = reciprocal_rank_fusion([[1, 2], [2, 1]], top_k=1, weights=[2.0, 1.0])
+    assert fused == [1]
+    # Большой k сглаживает разницу рангов, но не меняет порядок внутри одного списка
+    assert reciprocal_rank_fusion([[7, 8, 9]], top_k=3, k=RRF_K * 10) == [7, 8, 9]
+
+
+def test_bm25_matches_clause_numbers_and_word_forms():
+    index = BM25Index.build([{"text": "Пункт 4.2.6: высота потолков"}, {"text": "Пункт 4.2.7: ширина"}])
+    assert index.search("4.2.6", 2)[1].tolist() == [0]
+    assert index.search("высоты потолка", 2)[1].tolist() == [0]
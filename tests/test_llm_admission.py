@@ -0,0 +1,77 @@
+# tests/test_llm_admission.py
+import threading
+import time
+
+import pytest
+
+from llm_admission import DECREASE_FACTOR, AdmissionController
+
+
+def call(controller, session="s", eval_s=1.0, tokens=10):
+    controller.acquire(session)
+    controller.release(eval_s, True, tokens=tokens, eval_s=eval_s)
+
+
+def test_sequential_calls_do_not_raise_limit():
+    controller = AdmissionController(initial=2)
+    for _ in range(20):
+        call(controller)
+    assert controller.limit == 2
+
+
+def test_saturated_calls_raise_limit_additively():
+    controller = AdmissionController(initial=2)
+    controller.acquire("a")
+    controller.acquire("b")          # лимит занят полностью
+    controller.release(1.0, True, tokens=10, eval_s=1.0)
+    controller.release(1.0, True, tokens=10, eval_s=1.0)
+    assert controller.limit == pytest.approx(2.5)
+
+
+def test_slow_generation_decreases_limit_once_per_cooldown():
+    controller = AdmissionController(initial=4)
+    call(controller, eval_s=1.0)     # baseline 0.1 с/токен
+    call(controller, eval_s=5.0)
+    call(controller, eval_s=5.0)
+    assert controller.limit == pytest.approx(4 * DECREASE_FACTOR)
+    assert controller.decreases == 1
+
+
+def test_failed_call_decreases_limit():
+    controller = AdmissionController(initial=4)
+    controller.acquire()
+    controller.release(1.0, ok=False)
+    assert controller.limit == pytest.approx(4 * DECREASE_FACTOR)
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_sessions_are_served_round_robin():
+    controller = AdmissionController(initial=1)
+    controller.acquire("busy")
+    order = []
+
+    def waiter(session, priority=False):
+        controller.acquire(session, priority=priority)
+        order.append(session)
+
+    threads = []
+    for session, priority in [("a", False), ("a", False), ("a", False), ("b", False), ("c", False), ("reduce", True)]:
+        thread = threading.Thread(target=waiter, args=(session, priority))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: controller.queue_depth() == len(threads))
+
+    for granted in range(1, len(threads) + 1):
+        controller.release(1.0)      # без tokens лимит не меняется
+        wait_until(lambda: len(order) == granted)
+    for thread in threads:
+        thread.join()
+
+    # Приоритетный reduce — первым, затем сессии по кругу, а не три вызова "a" подряд
+    assert order == ["reduce", "a", "b", "c", "a", "a"]
@@ -0,0 +1,103 @@
+# tests/test_llm_deadline.py
+# Дедлайн map-этапа ограничивает полное время ответа: отменённые вызовы не занимают
+# слоты допуска, и финальный reduce не ждёт за ними в очереди
+import time
+
+import pytest
+
+import llm_client
+from llm_admission import AdmissionController
+from llm_client import OllamaClient, stream_generate
+from llm_orchestrator import MapTask, run_map_reduce
+from scripts.stub_ollama import StubConfig, start_stub_server
+
+CALL_S = 3.0        # ~30 токенов по 0.1 с
+DEADLINE = 1.0
+
+
+@pytest.fixture
+def stub_client(request):
+    # Параметр — (задержка токена, токенов в ответе); по умолчанию ~CALL_S на вызов
+    token_latency, tokens = getattr(request, "param", (CALL_S / 30, 30))
+    server = start_stub_server(StubConfig(token_latency=token_latency, prompt_eval_per_token=0.0,
+                                          concurrency=4, response_tokens=tokens, seed=0))
+    client = OllamaClient(url=f"http://127.0.0.1:{server.server_port}/api/generate", cache=None,
+                          admission=AdmissionController(initial=2))
+    previous, llm_client._client = llm_client._client, client
+    yield server
+    llm_client._client = previous
+    server.shutdown()
+    server.server_close()
+
+
+def call(prompt, model_name):
+    return llm_client.get_client().generate(prompt, model_name)["response"]
+
+
+def test_deadline_bounds_total_latency(stub_client):
+    tasks = [MapTask(0, "text", f"вопрос, батч {i}", "stub", [{"full_id": f"{i}.1"}]) for i in range(4)]
+
+    def reduce(partials, results):
+        return call("итог", "stub")
+
+    started = time.perf_counter()
+    answer, results = run_map_reduce(tasks, call, reduce, concurrency=4, deadline=DEADLINE)
+    elapsed = time.perf_counter() - started
+
+    assert answer
+    assert [r.late for r in results] == [True] * 4
+    # Дедлайн + один reduce, а не reduce после всех брошенных map-вызовов
+    assert elapsed < DEADLINE + CALL_S + 1.0
+    # Вызовы, ждавшие слот, отменены до отправки: на сервер ушли два map-вызова и reduce
+    assert stub_client.state.snapshot()["requests"] == 3
+
+
+def test_unfinished_retrieval_is_reported():
+    def slow_producer():
+        time.sleep(2)
+        return []
+
+    answer, results = run_map_reduce([], call, lambda partials, results: "ok",
+                                     producers={"table": slow_producer}, deadline=0.2)
+
+    assert answer == "ok"
+    assert [(r.kind, r.late, r.norms) for r in results] == [("table", True, [])]
+
+
+def test_failed_retrieval_is_reported():
+    def broken_producer():
+        raise RuntimeError("boom")
+
+    def table_producer():
+        return [MapTask(0, "table", "вопрос", "stub", [{"indicator": "t"}])]
+
+    answer, results = run_map_reduce([], lambda prompt, model_name: "частичный ответ",
+                                     lambda partials, results: " ".join(partials),
+                                     producers={"text": broken_producer, "table": table_producer})
+
+    assert answer == "частичный ответ"
+    failed = [r for r in results if not r.ok]
+    assert [(r.kind, r.late, r.norms) for r in failed] == [("text", False, [])]
+    assert "boom" in failed[0].error
+
+
+@pytest.mark.parametrize("stub_client", [(CALL_S / 30, 30), (DEADLINE * 1.5, 4)], indirect=True,
+                         ids=["streaming", "waiting-first-token"])
+def test_budget_cuts_final_reduce(stub_client):
+    # Бюджет на весь вопрос обрывает стрим reduce, в том числе пока он ждёт первый токен
+    def reduce(partials, results):
+        try:
+            return stream_generate("итог", "stub")
+        except llm_client.LLMCancelled:
+            return ""
+
+    started = time.perf_counter()
+    answer, results = run_map_reduce([], call, reduce, budget=DEADLINE)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < DEADLINE + 0.5
+    assert [(r.kind, r.late) for r in results] == [("reduce", True)]
+    # Сервер замечает закрытое соединение при следующей записи токена
+    while stub_client.state.snapshot()["cancelled"] < 1 and time.perf_counter() - started < 2 * CALL_S:
+        time.sleep(0.05)
+    assert stub_client.state.snapshot()["cancelled"] == 1
@@ -0,0 +1,48 @@
+# tests/test_norm_pruning.py
+from norm_pruning import prune_hits
+
+NO_GAP, NO_MASS = 1.0, 2.0   # отключают соответствующее отсечение
+
+
+def hits(*scores):
+    return [({"id": i}, s) for i, s in enumerate(scores)]
+
+
+def kept_ids(kept):
+    return [n["id"] for n in kept]
+
+
+def test_threshold_cut():
+    kept, report = prune_hits(hits(0.9, 0.8, 0.7, 0.5, 0.3, 0.2), min_score=0.35, max_gap=NO_GAP,
+                              mass=NO_MASS, min_keep=1)
+    assert kept_ids(kept) == [0, 1, 2, 3]
+    assert report["reason"] == "порог"
+
+
+def test_gap_cut():
+    kept, report = prune_hits(hits(0.9, 0.88, 0.86, 0.6, 0.58), min_score=0.0, max_gap=0.12,
+                              mass=NO_MASS, min_keep=1)
+    assert kept_ids(kept) == [0, 1, 2]
+    assert report["reason"] == "разрыв"
+
+
+def test_mass_cut():
+    # Полезная масса (выше порога 0.35): 0.6 + 0.55 = 92% — третья норма добирает до 95%
+    kept, report = prune_hits(hits(0.95, 0.9, 0.4, 0.38, 0.37), min_score=0.35, max_gap=NO_GAP,
+                              mass=0.95, min_keep=1)
+    assert kept_ids(kept) == [0, 1, 2]
+    assert report["reason"] == "масса"
+
+
+def test_min_keep_and_retriever_order():
+    # Оценки — в гибридном порядке выдачи; прошедшие нормы остаются в нём же
+    kept, report = prune_hits(hits(0.2, 0.9, 0.1, 0.3), min_score=0.5, min_keep=3,
+                              tokens_fn=lambda norm: 10)
+    assert kept_ids(kept) == [0, 1, 3]
+    assert (report["kept"], report["tokens_saved"]) == (3, 10)
+
+
+def test_short_list_is_kept():
+    kept, report = prune_hits(hits(0.1, 0.05), min_keep=3)
+    assert kept_ids(kept) == [0, 1]
+    assert report["reason"] is None
@@ -0,0 +1,46 @@
+# tests/test_norm_rag_facets.py
+# Фасетный индекс другой версии индекса или другого числа норм перестраивается
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from norm_rag import NormRAG, build_facet_index, facets_path, load_facet_index, save_facet_index
+
+NORMS = [
+    {"full_id": "1", "domain": "пожарная", "source": "СП 1"},
+    {"full_id": "2", "domain": "жилые", "source": "СП 1"},
+    {"full_id": "3", "domain": "пожарная", "source": "СП 2"},
+]
+
+
+def make_rag(tmp_path, norms, index_version):
+    rag = object.__new__(NormRAG)
+    rag.index_path = tmp_path / "norms.index"
+    rag.norms = norms
+    rag.index_version = index_version
+    return rag
+
+
+def test_current_facets_are_loaded(tmp_path):
+    rag = make_rag(tmp_path, NORMS, "v1")
+    facets = build_facet_index(NORMS)
+    facets["domain"]["пожарная"] = [2]   # метка: загружено из файла, а не построено
+    save_facet_index(facets, facets_path(rag.index_path), "v1")
+
+    rag._load_facets()
+
+    assert rag.facets["domain"]["пожарная"].tolist() == [2]
+
+
+@pytest.mark.parametrize("saved_norms, saved_version", [(NORMS, "v0"), (NORMS[:2], "v1")])
+def test_stale_facets_are_rebuilt(tmp_path, saved_norms, saved_version):
+    # Другая версия при том же числе норм — как после частичной пересборки или merge
+    rag = make_rag(tmp_path, NORMS, "v1")
+    save_facet_index(build_facet_index(saved_norms[1:] + saved_norms[:1]), facets_path(rag.index_path), saved_version)
+
+    rag._load_facets()
+
+    assert rag.facets["domain"]["пожарная"].tolist() == [0, 2]
+    saved = load_facet_index(facets_path(rag.index_path))
+    assert (saved["norms"], saved["index_version"]) == (3, "v1")
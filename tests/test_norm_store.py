@@ -0,0 +1,58 @@
+# tests/test_norm_store.py
+import json
+import os
+
+import pytest
+
+from norm_store import LOAD_MODES, NormStore, fetch_column, load_records, write_flat_records, write_norm_store
+
+NORMS = [
+    {"full_id": "1.1", "source": "СП 54", "domain": ["пожарная", "жилые"], "applies_to": ["кухня"], "text": "a"},
+    {"full_id": "1.2", "source": "СП 54", "domain": "жилые", "applies_to": [], "text": "b"},
+]
+
+
+@pytest.fixture
+def norms_file(tmp_path):
+    path = tmp_path / "norms.json"
+    path.write_text(json.dumps(NORMS, ensure_ascii=False), encoding="utf-8")
+    write_flat_records(NORMS, path)
+    write_norm_store(NORMS, path)
+    return path
+
+
+def rewrite(path, norms):
+    # Тот же размер файла, другое содержимое и время изменения — как после merge
+    stat = path.stat()
+    path.write_text(json.dumps(norms, ensure_ascii=False), encoding="utf-8")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.mark.parametrize("mode", LOAD_MODES)
+def test_columns_match_heap_records(norms_file, mode):
+    records = load_records(norms_file, mode)
+
+    assert [dict(r) for r in records] == NORMS
+    assert fetch_column(records, "domain") == [n["domain"] for n in NORMS]
+    assert fetch_column(records, "applies_to") == [n["applies_to"] for n in NORMS]
+
+
+def test_fresh_store_is_used(norms_file):
+    assert isinstance(load_records(norms_file, "sqlite"), NormStore)
+
+
+@pytest.mark.parametrize("mode", ["sqlite", "mmap"])
+def test_stale_store_falls_back_to_source(norms_file, mode):
+    changed = [dict(NORMS[0], text="c"), NORMS[1]]
+    rewrite(norms_file, changed)
+
+    records = load_records(norms_file, mode)
+
+    assert isinstance(records, list)
+    assert records[0]["text"] == "c"
+
+
+def test_store_without_source_file_is_used(norms_file):
+    norms_file.unlink()
+
+    assert load_records(norms_file, "sqlite")[0]["text"] == "a"
@@ -0,0 +1,88 @@
+# tests/test_prompt_packer.py
+import pytest
+
+import model_routing
+import new_model_check
+import prompt_packer
+from prompt_packer import RESPONSE_RESERVE, pack_norm_batches
+
+SOURCES = {"Жилые здания": "жилые здания", "Дошкольные учреждения": "доу",
+           "Школы": "школы", "Административные здания": "административные"}
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    # Токен = символ: результат не зависит от наличия токенизатора HF
+    monkeypatch.setattr(prompt_packer, "count_tokens", lambda text, model_name: len(text))
+    monkeypatch.setattr(new_model_check, "count_tokens", lambda text, model_name: len(text))
+
+
+def norm(category, tokens, name=""):
+    # format_norm(norm) + перевод строки = tokens
+    return {"source": SOURCES[category], "text": (name or category[0]) * (tokens - 1)}
+
+
+def pack(norms, budget, header=None):
+    return pack_norm_batches(norms, "stub", lambda n: n["text"], 0, header=header, budget=budget)
+
+
+def test_first_fit_decreasing_fills_bins():
+    norms = [norm("Школы", 4), norm("Жилые здания", 6), norm("Административные здания", 3),
+             norm("Дошкольные учреждения", 5)]
+
+    batches = pack(norms, budget=10)
+
+    # По убыванию: 6 → [6], 5 → [6][5], 4 → [6+4], 3 → [5+3]
+    assert [[len(n["text"]) + 1 for n in b] for b in batches] == [[6, 4], [5, 3]]
+
+
+def test_category_stays_in_one_batch():
+    norms = [norm("Жилые здания", 3, "a"), norm("Школы", 3), norm("Жилые здания", 3, "b"),
+             norm("Школы", 3), norm("Жилые здания", 3, "c")]
+
+    batches = pack(norms, budget=9)
+
+    assert [{n["source"] for n in b} for b in batches] == [{"жилые здания"}, {"школы"}]
+    assert [n["text"] for n in batches[0]] == ["aa", "bb", "cc"]
+
+
+def test_oversized_category_is_split_within_budget():
+    norms = [norm("Жилые здания", 4, str(i)) for i in range(5)]
+
+    batches = pack(norms, budget=30, header=lambda category: category)
+
+    # Заголовок (13 токенов) повторяется в каждой части: 13 + 4 * 4 = 29, остаток — отдельно
+    assert [len(b) for b in batches] == [4, 1]
+    assert [n["text"] for b in batches for n in b] == [n["text"] for n in norms]
+
+
+class RecordingClient:
+    admission = None
+
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, prompt, model_name, options=None, use_cache=False):
+        self.calls.append((prompt, model_name, options))
+        return {"response": "частичный ответ"}
+
+
+def test_map_prompts_fit_model_context(monkeypatch):
+    client = RecordingClient()
+    monkeypatch.setattr(new_model_check, "get_client", lambda: client)
+    monkeypatch.setattr(model_routing, "get_client", lambda: client)
+    question, source = "Какая высота потолка?", "проект"
+    prefix = len(new_model_check.generate_categorized_prompt([], [], question, source))
+    context = RESPONSE_RESERVE + prefix + 700
+    monkeypatch.setitem(prompt_packer.MODEL_CONTEXT, "gpt-oss", context)
+    norms = [dict(norm(category, 120, str(i % 10)), full_id=f"{i}.1")
+             for i, category in enumerate(list(SOURCES) * 3)]
+
+    new_model_check.check_multi_norms_mistral_nemo_parallel4(norms, [], question, source, deadline=None, budget=None)
+
+    map_prompts = [prompt for prompt, _, _ in client.calls if "(Текстовые нормы)" in prompt]
+    assert len(map_prompts) > 1
+    assert all(len(prompt) <= context - RESPONSE_RESERVE for prompt in map_prompts)
+    # Каждая норма — ровно в одном map-промпте
+    assert sorted(sum(p.count(f"\n{i}.1- ") for p in map_prompts) for i in range(len(norms))) == [1] * len(norms)
+    assert all(options == {"num_ctx": context} for _, _, options in client.calls)
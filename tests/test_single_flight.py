@@ -0,0 +1,118 @@
+# tests/test_single_flight.py
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+KEY = "вопрос"
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def progress(self, value):
+        self.calls.append(("progress", value))
+
+    def text(self, value):
+        self.calls.append(("text", value))
+
+    def markdown(self, value):
+        self.calls.append(("markdown", value))
+
+
+class StopRun(BaseException):
+    # Как StopException/RerunException Streamlit — не наследует Exception
+    pass
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def start_leader(flight, outcome, release, box):
+    # Ведущая сессия: публикует прогресс и ждёт release, затем отдаёт/бросает outcome
+    def fn(bar, label, answer):
+        bar.progress(0.5)
+        release.wait(2)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def run():
+        try:
+            box["leader"] = flight.run(KEY, fn, Recorder(), Recorder())
+        except BaseException as e:
+            box["leader"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_until(lambda: flight.in_flight() == 1)
+    return thread
+
+
+def start_follower(flight, box, fn=None):
+    bar = Recorder()
+
+    def run():
+        try:
+            box["follower"] = flight.run(KEY, fn or (lambda *args: "свой ответ"), bar, Recorder())
+        except BaseException as e:
+            box["follower"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    wait_until(lambda: flight._flights[KEY].followers == 1)
+    return thread, bar
+
+
+def test_follower_gets_leader_result_and_progress():
+    flight, release, box = SingleFlight(), threading.Event(), {}
+    leader = start_leader(flight, "ответ", release, box)
+    follower, bar = start_follower(flight, box, fn=lambda *args: pytest.fail("посчитано дважды"))
+
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert box == {"leader": ("ответ", False), "follower": ("ответ", True)}
+    assert ("progress", 0.5) in bar.calls
+    assert flight.in_flight() == 0
+
+
+def test_leader_error_is_shared():
+    flight, release, box = SingleFlight(), threading.Event(), {}
+    error = RuntimeError("boom")
+    leader = start_leader(flight, error, release, box)
+    follower, _ = start_follower(flight, box)
+
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert box["leader"] is error and box["follower"] is error
+
+
+def test_follower_reruns_when_leader_is_stopped():
+    flight, release, box = SingleFlight(), threading.Event(), {}
+    leader = start_leader(flight, StopRun(), release, box)
+    follower, _ = start_follower(flight, box)
+
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert isinstance(box["leader"], StopRun)
+    assert box["follower"] == ("свой ответ", False)
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+    assert flight.run("a", lambda *args: 1) == (1, False)
+    assert flight.run("b", lambda *args: 2) == (2, False)